@@ -0,0 +1,225 @@
+""" Benchmarks for the hot paths of the game. Runs without a window, using SDL's dummy video driver.
+
+    python benchmarks.py --output results.json
+    python benchmarks.py --output new.json --compare results.json --threshold 10
+
+Every case runs on boards and pieces made from fixed seeds, so results from two builds can be compared. """
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import itertools
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import numpy as np
+import pygame
+import constants
+from board import Board
+from engine import Engine
+from pieces import RANDOMIZERS, Piece, PieceSource
+from typing import Callable, Dict, Optional
+from vector_env import VectorEnv
+
+SEED = 1234
+# Frames of a new game timed by the loop case.
+LOOP_FRAMES = 300
+# Games stepped at once by the VectorEnv case, which is timed per game.
+VECTOR_ENVS = 256
+
+
+def make_board(fill: float, complete_rows: int = 0, seed: int = SEED) -> Board:
+    """ Returns a board filled from the bottom to the given fraction of its height.
+        --- The lowest complete_rows rows are full; every other filled row has one random gap, so it can't clear. """
+    rng = random.Random(seed)
+    board = Board()
+    filled_rows = max(int(board.height * fill), complete_rows)
+    for y in range(board.height - filled_rows, board.height):
+        if y >= board.height - complete_rows:
+            gaps = set()
+        else:
+            gaps = {rng.randrange(board.width)}
+        board.place([(x, y) for x in range(board.width) if x not in gaps], rng.randint(1, len(constants.COLOURS)))
+    return board
+
+
+def copy_board(board: Board) -> Board:
+    copy = Board(board.width, board.height)
+    copy.cells[:] = board.cells
+    copy.row_counts = list(board.row_counts)
+    copy.heights = list(board.heights)
+    copy.hash = board.hash
+    return copy
+
+
+def make_piece(board: Board, seed: int = SEED) -> Piece:
+    """ Returns a piece resting on top of the stack, for collision checks to work against. """
+    piece = PieceSource(seed).next_piece()
+    piece.x = piece.spawn_x
+    piece.y = -piece.get_rotation().max_y
+    while board.fits(piece.get_cells(dy=1)):
+        piece.y += 1
+    return piece
+
+
+def measure(function: Callable[[], None], setup: Optional[Callable[[], None]] = None,
+            min_time: float = 0.2, repeats: int = 5) -> Dict[str, float]:
+    """ Runs function repeatedly and returns the time per call in nanoseconds.
+        --- If there is a setup function it's called before every call, outside the timed part. """
+    results = []
+    iterations = 0
+    for _ in range(repeats):
+        elapsed = 0
+        calls = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < min_time / repeats:
+            if setup is not None:
+                setup()
+            before = time.perf_counter_ns()
+            function()
+            elapsed += time.perf_counter_ns() - before
+            calls += 1
+        results.append(elapsed / calls)
+        iterations += calls
+    return {"median_ns": statistics.median(results), "best_ns": min(results), "iterations": iterations}
+
+
+def run_benchmarks(min_time: float) -> Dict[str, Dict[str, float]]:
+    results = {}
+
+    for fill in (0.0, 0.5, 0.9):
+        board = make_board(fill)
+        piece = make_piece(board)
+        name = "{:.0f}%".format(fill * 100)
+        results["y_collision[{}]".format(name)] = measure(lambda: piece.y_collision(board), min_time=min_time)
+        results["x_collision[{}]".format(name)] = measure(lambda: piece.x_collision("left", board),
+                                                           min_time=min_time)
+        # From the spawn row, the whole way down.
+        cells = piece.get_cells(dy=-piece.y - piece.get_rotation().max_y)
+        results["drop_distance[{}]".format(name)] = measure(lambda: board.drop_distance(cells), min_time=min_time)
+
+    for complete_rows in range(5):
+        template = make_board(0.5, complete_rows)
+        boards = []
+        results["clear_full_rows[{}]".format(complete_rows)] = measure(
+            lambda: boards[-1].clear_full_rows(), setup=lambda: boards.append(copy_board(template)),
+            min_time=min_time)
+        boards.clear()
+
+    engine = Engine(SEED)
+    engine.board = make_board(0.5)
+    snapshot = engine.snapshot()
+    results["Engine.snapshot"] = measure(engine.snapshot, min_time=min_time)
+    results["Engine.restore"] = measure(lambda: engine.restore(snapshot), min_time=min_time)
+
+    for randomizer in RANDOMIZERS:
+        source = PieceSource(SEED, randomizer)
+        results["next_piece[{}]".format(randomizer)] = measure(source.next_piece, min_time=min_time)
+
+    env = VectorEnv(VECTOR_ENVS, SEED)
+    rng = random.Random(SEED)
+    actions = [np.array([rng.choice((0, 0, 0, 1, 2, 3, 4)) for _ in range(VECTOR_ENVS)]) for _ in range(64)]
+    steps = itertools.cycle(actions)
+    results["VectorEnv.step"] = measure(lambda: env.step(next(steps)), min_time=min_time)
+    results["VectorEnv.step"]["median_ns"] /= VECTOR_ENVS
+    results["VectorEnv.step"]["best_ns"] /= VECTOR_ENVS
+
+    # Drawing needs a display, even a dummy one.
+    import tet_two
+
+    pygame.display.init()
+    pygame.display.set_mode((18*constants.BLOCK_SIZE, 22*constants.BLOCK_SIZE))
+    tet_two.BlockAtlas.load()
+    pieces = PieceSource(SEED)
+    results["Tetromino()"] = measure(lambda: tet_two.Tetromino(pieces.next_piece()), min_time=min_time)
+    pool = tet_two.TetrominoPool()
+    results["TetrominoPool.acquire"] = measure(lambda: pool.release(pool.acquire(pieces.next_piece())),
+                                               min_time=min_time)
+
+    surface = pygame.Surface((constants.BOARD_WIDTH*constants.BLOCK_SIZE, constants.BOARD_HEIGHT*constants.BLOCK_SIZE))
+    tetromino = tet_two.Tetromino(make_piece(Board()))
+    results["Tetromino.draw"] = measure(lambda: tetromino.draw(surface), min_time=min_time)
+
+    from observations import BoardObserver
+
+    observed = Engine(SEED)
+    observed.board = make_board(0.5)
+    observer = BoardObserver(observed)
+    results["BoardObserver.render"] = measure(observer.render, min_time=min_time)
+
+    # A new game for each repeat, so every repeat times the same frames.
+    games = []
+    results["loop"] = measure(lambda: run_frames(games[-1], LOOP_FRAMES), setup=lambda: games.append(new_game()),
+                              min_time=min_time)
+    results["loop"]["median_ns"] /= LOOP_FRAMES
+    results["loop"]["best_ns"] /= LOOP_FRAMES
+    return results
+
+
+def new_game():
+    """ Returns a game where every frame runs exactly one tick, and nothing waits for the frame rate. """
+    import tet_two
+
+    game = tet_two.SetupGame(SEED)
+    game.scheduler.advance = lambda: 1
+    game.clock = NoWaitClock()
+    return game
+
+
+def run_frames(game, frames: int) -> None:
+    for _ in range(frames):
+        game.loop()
+
+
+class NoWaitClock:
+    """ Stands in for pygame.time.Clock, without waiting. """
+
+    def tick(self, framerate: int = 0) -> int:
+        return 0
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float) -> bool:
+    """ Prints each case against the baseline. Returns true if any case is slower by more than threshold %. """
+    regressed = False
+    for name, stats in results.items():
+        if name not in baseline:
+            print("{:28} {:>12.0f} ns  (new)".format(name, stats["median_ns"]))
+            continue
+        change = (stats["median_ns"] / baseline[name]["median_ns"] - 1) * 100
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        print("{:28} {:>12.0f} ns  {:+7.1f}%{}".format(name, stats["median_ns"], change, flag))
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the hot paths of the game, without a window.")
+    parser.add_argument("--output", metavar="FILE", help="save the results to FILE as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="compare against results saved with --output")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="percentage slowdown that counts as a regression (default 10)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds to spend on each case")
+    args = parser.parse_args()
+
+    benchmark_results = run_benchmarks(args.min_time)
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump({"python": platform.python_version(),
+                       "pygame": pygame.version.ver,
+                       "platform": platform.platform(),
+                       "seed": SEED,
+                       "results": benchmark_results}, output_file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline_results = json.load(baseline_file)["results"]
+        sys.exit(1 if compare(benchmark_results, baseline_results, args.threshold) else 0)
+    for case, case_stats in benchmark_results.items():
+        print("{:28} {:>12.0f} ns".format(case, case_stats["median_ns"]))
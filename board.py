@@ -0,0 +1,158 @@
+import constants
+import zobrist
+from typing import Iterable, List, Tuple
+
+# Bits used by pack() for the colour of each occupied cell.
+COLOUR_BITS = max(1, (len(constants.COLOURS) - 1).bit_length())
+# Tables for bytes.translate(), turning cells into digits that int() can read in one go.
+OCCUPIED_DIGITS = b"0" + b"1" * 255
+COLOUR_DIGITS = b"0" + bytes(b"0123456789abcdefghijklmnopqrstuvwxyz"[(value - 1) % 36] for value in range(1, 256))
+
+
+class Board:
+    """ Occupancy grid of the game area, used for collision detection.
+        --- Cells are stored row by row in a bytearray, 0 is an empty cell.
+        --- Rows above the top of the board (y < 0) are always free, so Tetrominoes can spawn there.
+        --- A count of filled cells is kept for each row, so complete rows can be found without a scan.
+        --- The height of each column, up to its highest block, is kept too, so drop_distance() can find where
+            a Tetromino lands from the top of the stack instead of trying every row.
+        --- hash is the Zobrist hash of which cells are occupied, ignoring colour. It's kept up to date by
+            place() and clear_full_rows(), so boards can be compared and looked up without reading the cells. """
+
+    def __init__(self, width: int = constants.BOARD_WIDTH, height: int = constants.BOARD_HEIGHT):
+        self.width: int = width
+        self.height: int = height
+        self.cells: bytearray = bytearray(width * height)
+        self.row_counts: List[int] = [0] * height
+        self.heights: List[int] = [0] * width
+        self.keys: Tuple[int, ...] = zobrist.cell_keys(width, height)
+        self.hash: int = 0
+
+    def pack(self) -> bytes:
+        """ Returns the board as one bit per cell for occupancy, followed by COLOUR_BITS bits for the colour
+            of each occupied cell. Both are in cell order, least significant bit first. """
+        size = self.width * self.height
+        occupancy = int(self.cells.translate(OCCUPIED_DIGITS)[::-1], 2)
+        colours = self.cells.translate(COLOUR_DIGITS, b"\x00")[::-1]
+        colour_bits = int(colours, 1 << COLOUR_BITS) if colours else 0
+        return (occupancy.to_bytes((size + 7) // 8, "little")
+                + colour_bits.to_bytes((len(colours) * COLOUR_BITS + 7) // 8, "little"))
+
+    @classmethod
+    def unpack(cls, data: bytes, position: int = 0, width: int = constants.BOARD_WIDTH,
+               height: int = constants.BOARD_HEIGHT) -> Tuple["Board", int]:
+        """ Reads a board written by pack(). Returns the board and the position after it. """
+        board = cls(width, height)
+        occupancy_size = (width * height + 7) // 8
+        if position + occupancy_size > len(data):
+            raise ValueError("Board ended early")
+        occupancy = int.from_bytes(data[position:position + occupancy_size], "little")
+        position += occupancy_size
+        filled = [i for i, bit in enumerate(reversed(bin(occupancy)[2:])) if bit == "1"]
+        colours_size = (len(filled) * COLOUR_BITS + 7) // 8
+        if position + colours_size > len(data):
+            raise ValueError("Board ended early")
+        colours = int.from_bytes(data[position:position + colours_size], "little")
+        mask = (1 << COLOUR_BITS) - 1
+        for i in filled:
+            board.cells[i] = (colours & mask) + 1
+            y, x = divmod(i, width)
+            board.row_counts[y] += 1
+            board.heights[x] = max(board.heights[x], height - y)
+            board.hash ^= board.keys[i]
+            colours >>= COLOUR_BITS
+        return board, position + colours_size
+
+    def in_bounds(self, x: int, y: int) -> bool:
+        """ Returns true if the cell is inside the walls and above the floor. """
+        return 0 <= x < self.width and y < self.height
+
+    def is_occupied(self, x: int, y: int) -> bool:
+        """ Returns true if the cell is inside the game area and holds a static block. """
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.cells[y * self.width + x] != 0
+        return False
+
+    def is_free(self, x: int, y: int) -> bool:
+        """ Returns true if a block could occupy the cell. """
+        return self.in_bounds(x, y) and not self.is_occupied(x, y)
+
+    def fits(self, cells: Iterable[Tuple[int, int]]) -> bool:
+        """ Returns true if every one of the given cells is free. """
+        for x, y in cells:
+            if not self.is_free(x, y):
+                return False
+        return True
+
+    def place(self, cells: Iterable[Tuple[int, int]], value: int = 1) -> None:
+        """ Marks the given cells as occupied. Cells above the game area are ignored. """
+        for x, y in cells:
+            if 0 <= x < self.width and 0 <= y < self.height:
+                i = y * self.width + x
+                if not self.cells[i]:
+                    self.row_counts[y] += 1
+                    self.hash ^= self.keys[i]
+                    if self.height - y > self.heights[x]:
+                        self.heights[x] = self.height - y
+                self.cells[i] = value
+
+    def drop_distance(self, cells: Iterable[Tuple[int, int]]) -> int:
+        """ Returns how many rows the cells can move straight down before they'd hit a static block or the floor.
+            --- Cells above the highest block of their column can fall to just above it. A cell that's already
+                below the top of its column, under an overhang, could stop sooner, so then each row is tried. """
+        cells = list(cells)
+        distance = self.height
+        for x, y in cells:
+            top = self.height - self.heights[x]
+            if y >= top:
+                distance = 0
+                while self.fits([(column, row + distance + 1) for column, row in cells]):
+                    distance += 1
+                return distance
+            distance = min(distance, top - 1 - y)
+        return distance
+
+    def full_rows(self) -> List[int]:
+        """ Returns the index of every complete row, from top to bottom. """
+        return [y for y, count in enumerate(self.row_counts) if count == self.width]
+
+    def clear_full_rows(self) -> List[int]:
+        """ Removes every complete row and moves the rows above them down, in a single pass.
+            --- Returns the indexes the cleared rows had before they were removed. """
+        cleared = self.full_rows()
+        if not cleared:
+            return cleared
+        width = self.width
+        tables = zobrist.row_tables(width, self.height)
+        full_rows = zobrist.full_row_keys(width, self.height)
+        for y in cleared:
+            self.hash ^= full_rows[y]
+        # Walk up from the bottom, copying each kept row down to the next free slot.
+        write = self.height - 1
+        for read in range(self.height - 1, -1, -1):
+            if self.row_counts[read] == width:
+                continue
+            if write != read:
+                row = self.cells[read * width:(read + 1) * width]
+                self.cells[write * width:(write + 1) * width] = row
+                self.row_counts[write] = self.row_counts[read]
+                # The row's blocks leave their old cells and fill the same columns of their new ones.
+                if self.row_counts[read]:
+                    mask = int(row.translate(OCCUPIED_DIGITS)[::-1], 2)
+                    self.hash ^= zobrist.row_hash(tables[read], mask) ^ zobrist.row_hash(tables[write], mask)
+            write -= 1
+        # Everything above the last kept row is now empty.
+        self.cells[:(write + 1) * width] = bytes((write + 1) * width)
+        self.row_counts[:write + 1] = [0] * (write + 1)
+        # A column whose highest block was kept just moves down. One whose highest block was cleared is
+        # searched for its new highest block, from the top of the stack down.
+        for x in range(width):
+            if self.height - self.heights[x] not in cleared:
+                self.heights[x] -= len(cleared)
+                continue
+            self.heights[x] = 0
+            for y in range(write + 1, self.height):
+                if self.cells[y * width + x]:
+                    self.heights[x] = self.height - y
+                    break
+        return cleared
@@ -0,0 +1,180 @@
+import time
+import numpy as np
+import placements
+import zobrist
+from engine import Engine, Action
+from pieces import Piece
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+class Heuristic(NamedTuple):
+    """ Weights for scoring a board after a placement. Higher scores are better. """
+
+    lines: float = 0.76
+    holes: float = -0.36
+    aggregate_height: float = -0.51
+    bumpiness: float = -0.18
+    # Added to any placement that leaves a block in the top two rows, which ends the game.
+    top_out: float = -1e9
+
+    def evaluate(self, found: placements.Placements, top_out_height: int) -> np.ndarray:
+        """ Scores every placement, not counting lines. Lines are added up separately, across the search. """
+        scores = (self.holes * found.holes + self.aggregate_height * found.aggregate_height
+                  + self.bumpiness * found.bumpiness)
+        return scores + np.where(found.heights.max(axis=1) >= top_out_height, self.top_out, 0.0)
+
+
+class BeamSearchBot:
+    """ Plays the game by searching over the placements of the current and upcoming Tetrominoes.
+        --- Each level of the search keeps the beam_width best boards and expands them with the next piece.
+        --- The search stops when budget_ms runs out, and the best move from the deepest complete level is played.
+            A budget_ms of None searches every level, so the moves chosen depend only on the game.
+        --- Once a move is chosen, the actions to reach it are all given on one tick, followed by a soft drop.
+        --- lookahead is how many upcoming Tetrominoes it searches, which should be no more than are shown.
+        --- The same board is often reached by different placements, and by the search for the next move.
+            Boards are compared by their Zobrist hash: the beam only keeps one of each, and the placements
+            and scores found from a board are kept in a TranspositionTable of up to cache_bytes, evicted by
+            cache_policy. A cache_bytes of 0 turns the cache off. """
+
+    def __init__(self, heuristic: Optional[Heuristic] = None, beam_width: int = 8,
+                 budget_ms: Optional[float] = 8.0, lookahead: int = 1, cache_bytes: int = 32 * 2**20,
+                 cache_policy: str = "lru"):
+        self.heuristic: Heuristic = heuristic if heuristic is not None else Heuristic()
+        self.beam_width: int = beam_width
+        self.budget_ms: Optional[float] = budget_ms
+        self.lookahead: int = lookahead
+        self.cache: Optional[zobrist.TranspositionTable] = None
+        if cache_bytes > 0:
+            self.cache = zobrist.TranspositionTable(cache_bytes, cache_policy)
+
+        self.planned_piece: Optional[Piece] = None
+        # How many searches ran out of time, and how long the last one took.
+        self.timeouts: int = 0
+        self.last_search_ms: float = 0.0
+
+    def actions(self, engine: Engine) -> List[Action]:
+        """ Returns the moves to the chosen placement when a new Tetromino spawns, otherwise nothing. """
+        piece = engine.current_piece
+        if engine.game_over or piece is self.planned_piece:
+            return []
+        self.planned_piece = piece
+
+        target = self.choose(engine)
+        if target is None:
+            return [Action.SOFT_DROP]
+        return self.moves_to(engine, target) + [Action.SOFT_DROP]
+
+    def upcoming_shapes(self, engine: Engine) -> List[str]:
+        """ Returns the shapes of the current Tetromino and the next lookahead Tetrominoes. """
+        return [engine.current_piece.shape] + [piece.shape for piece in engine.upcoming(self.lookahead)]
+
+    def choose(self, engine: Engine) -> Optional[Tuple[int, int]]:
+        """ Returns the rotation and x co-ordinate to drop the current Tetromino at. """
+        start = time.perf_counter()
+        deadline = start + self.budget_ms / 1000 if self.budget_ms is not None else float("inf")
+        upcoming = self.upcoming_shapes(engine)
+        depth = len(upcoming) - 1
+        top_out_height = engine.board.height - 1
+
+        roots, rewards, evaluations = self.expand(engine.board, engine.board.hash, upcoming[0], depth,
+                                                  top_out_height)
+        if len(roots.x) == 0:
+            return None
+        scores = rewards + evaluations
+        best = int(np.argmax(scores))
+
+        # Each entry of the beam is (root placement, board, board hash, lines reward so far, score).
+        beam = self.best_of([(int(i), roots.boards[i], int(roots.hashes[i]), rewards[i], scores[i])
+                             for i in np.argsort(-scores)])
+        for level, shape in enumerate(upcoming[1:], 1):
+            candidates = []
+            for root, board, board_hash, reward, score in beam:
+                if time.perf_counter() > deadline:
+                    break
+                found, found_rewards, found_evaluations = self.expand(board, board_hash, shape, depth - level,
+                                                                      top_out_height)
+                if len(found.x) == 0:
+                    continue
+                found_rewards = reward + found_rewards
+                found_scores = found_rewards + found_evaluations
+                for i in np.argsort(-found_scores)[:self.beam_width]:
+                    candidates.append((root, found.boards[i], int(found.hashes[i]), found_rewards[i],
+                                       found_scores[i]))
+            else:
+                if candidates:
+                    candidates.sort(key=lambda candidate: -candidate[4])
+                    beam = self.best_of(candidates)
+                    best = beam[0][0]
+                continue
+            # Out of time part way through a level, so the last complete level's choice stands.
+            self.timeouts += 1
+            break
+
+        self.last_search_ms = (time.perf_counter() - start) * 1000
+        return int(roots.rotation[best]), int(roots.x[best])
+
+    def best_of(self, candidates: List[Tuple]) -> List[Tuple]:
+        """ Returns the first beam_width candidates, skipping any board already in the beam. The candidates
+            should be sorted best first. """
+        beam = []
+        seen = set()
+        for candidate in candidates:
+            if candidate[2] not in seen:
+                seen.add(candidate[2])
+                beam.append(candidate)
+                if len(beam) == self.beam_width:
+                    break
+        return beam
+
+    def expand(self, board, board_hash: int, shape: str, depth: int,
+               top_out_height: int) -> Tuple[placements.Placements, np.ndarray, np.ndarray]:
+        """ Returns every placement of the shape on the board, with the lines reward and evaluation of each.
+            --- Looked up in the cache first, by the board's hash and the shape. """
+        key = board_hash ^ zobrist.shape_key(shape)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        found = placements.enumerate_placements(board, shape)
+        result = (found, self.heuristic.lines * found.lines, self.heuristic.evaluate(found, top_out_height))
+        if self.cache is not None:
+            self.cache.put(key, result, sum(array.nbytes for array in found) + result[1].nbytes + result[2].nbytes,
+                           depth)
+        return result
+
+    def stats(self) -> Dict[str, float]:
+        """ Returns how many searches ran out of time, and how well the cache is doing. """
+        stats = {"timeouts": self.timeouts}
+        if self.cache is not None:
+            for name, value in self.cache.stats().items():
+                stats["cache_" + name] = value
+        return stats
+
+    def moves_to(self, engine: Engine, target: Tuple[int, int]) -> List[Action]:
+        """ Works out the rotations and shifts that take the current Tetromino to the target, by trying them
+            on a copy with the same rules as Engine.act(). """
+        rotation, x = target
+        piece = engine.current_piece
+        board = engine.board
+        ghost = Piece(piece.shape, piece.colour)
+        ghost.current_rotation, ghost.x, ghost.y = piece.current_rotation, piece.x, piece.y
+
+        moves = []
+        for _ in range(16):
+            if ghost.current_rotation != rotation:
+                next_rotation = ghost.next_rotation()
+                if board.fits(ghost.get_cells(rotation=next_rotation)):
+                    ghost.current_rotation = next_rotation
+                    moves.append(Action.ROTATE)
+                    continue
+                # Blocked by a wall, so shift towards the target or away from the wall first.
+                direction = "left" if x < ghost.x or (x == ghost.x and ghost.x > board.width // 2) else "right"
+            elif ghost.x != x:
+                direction = "left" if x < ghost.x else "right"
+            else:
+                break
+            if not ghost.confined(direction) or ghost.x_collision(direction, board):
+                break
+            ghost.x += -1 if direction == "left" else 1
+            moves.append(Action.LEFT if direction == "left" else Action.RIGHT)
+        return moves
@@ -0,0 +1,225 @@
+""" Consistency checks between parts of the game that must agree with each other. Runs without a window.
+
+    python checks.py
+    python checks.py --only vector_env --seed 7
+
+Each check plays games from fixed seeds and counts mismatches, and the script exits with 1 if any check finds one. """
+import argparse
+import os
+import random
+import sys
+import numpy as np
+from engine import Action, Engine
+from pieces import SHAPE_INDEXES
+from replay import Replay, ReplayPlayer, ReplayRecorder
+from typing import Callable, Dict, List, Tuple
+
+# Actions given on a step of a check, as a weighted list to choose from. 0 gives no action.
+RANDOM_ACTIONS = [Action.LEFT, Action.RIGHT, Action.ROTATE, Action.SOFT_DROP, Action.HARD_DROP,
+                  Action.LEFT, Action.RIGHT, Action.ROTATE]
+
+
+def board_array(engine: Engine) -> np.ndarray:
+    board = engine.board
+    return np.frombuffer(bytes(board.cells), dtype=np.uint8).reshape(board.height, board.width)
+
+
+def prefill(engine: Engine, rows: np.ndarray, rng: np.random.Generator) -> None:
+    """ Fills the bottom half of the board with rows that are each one block short of complete, on both the
+        engine's board and rows, such as the matching VectorEnv board, so line clears and scoring are exercised. """
+    board = engine.board
+    for y in range(board.height // 2, board.height):
+        gap = rng.integers(board.width)
+        cells = [(x, y) for x in range(board.width) if x != gap]
+        board.place(cells, 1)
+        for x, _ in cells:
+            rows[y, x] = 1
+
+
+def check_vector_env(seed: int, envs: int = 32, steps: int = 5000) -> int:
+    """ Steps a VectorEnv and one Engine per game with the same random actions, and counts every tick where a
+        game's board, Tetromino, score, level or gravity timer differ, or where they disagree about game over.
+        --- The first game of every env starts on a part-filled board. """
+    from vector_env import VectorEnv
+
+    env = VectorEnv(envs, seed=seed)
+    rng = np.random.default_rng(seed)
+    engines = [Engine(int(episode_seed)) for episode_seed in env.seeds]
+    for i, engine in enumerate(engines):
+        prefill(engine, env.boards[i], rng)
+    choices = np.array([0] * len(RANDOM_ACTIONS) * 2 + [int(action) for action in RANDOM_ACTIONS])
+
+    mismatches = 0
+    for _ in range(steps):
+        actions = rng.choice(choices, envs)
+        observation, rewards, done, info = env.step(actions)
+        for i, engine in enumerate(engines):
+            score = engine.score.score
+            if actions[i]:
+                engine.act(Action(int(actions[i])))
+            engine.tick()
+            if rewards[i] != engine.score.score - score:
+                mismatches += 1
+            if done[i]:
+                if (not engine.game_over or info["score"][i] != engine.score.score
+                        or info["lines_cleared"][i] != engine.lines_cleared
+                        or info["pieces_placed"][i] != engine.pieces_placed):
+                    mismatches += 1
+                engines[i] = Engine(int(env.seeds[i]))
+                continue
+            piece = engine.current_piece
+            if (engine.game_over or not (board_array(engine) == env.boards[i]).all()
+                    or (SHAPE_INDEXES[piece.shape], piece.current_rotation, piece.x, piece.y)
+                    != (env.shape[i], env.rotation[i], env.x[i], env.y[i])
+                    or (engine.score.score, engine.score.level, engine.gravity_timer)
+                    != (env.score[i], env.level[i], env.gravity_timer[i])):
+                mismatches += 1
+    return mismatches
+
+
+def check_renderer(seed: int, games: int = 12, frames: int = 1500) -> int:
+    """ Plays offscreen games and counts the frames where the window drawn a piece at a time differs from a
+        second Renderer on the same engine that draws everything from scratch.
+        --- Every frame runs a random number of ticks, so several Tetrominoes can stop between draws, and
+            snapshots are saved and restored now and then. Every fourth game is played by the bot, which clears
+            lines, and the rest by random keys, which end in game over. """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import pygame
+    import bot
+    import tet_two
+
+    class NoWaitClock:
+        def tick(self, framerate: int = 0) -> int:
+            return 0
+
+    keys = [pygame.K_LEFT, pygame.K_RIGHT, pygame.K_SPACE, pygame.K_DOWN, pygame.K_UP]
+    mismatches = 0
+    for game_seed in range(seed, seed + games):
+        rng = random.Random(game_seed)
+        autoplay = bot.BeamSearchBot(budget_ms=None) if game_seed % 4 == 0 else None
+        game = tet_two.SetupGame(game_seed, autoplay=autoplay, offscreen=True)
+        game.clock = NoWaitClock()
+        game.scheduler.advance = lambda: rng.choice([1, 1, 2, 5, 20])
+        reference = tet_two.Renderer(pygame.Surface(game.main_window_size), game.engine)
+        for _ in range(frames):
+            if rng.random() < 0.01:
+                game.saved_snapshot = game.engine.snapshot()
+            if rng.random() < 0.005 and game.saved_snapshot is not None:
+                game.restore(game.saved_snapshot)
+                reference.reset()
+            if autoplay is None and rng.random() < 0.2:
+                pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=rng.choice(keys)))
+            game.loop()
+            reference.invalidate()
+            reference.draw()
+            if pygame.image.tostring(game.main_window, "RGB") != pygame.image.tostring(reference.main_window, "RGB"):
+                mismatches += 1
+            if game.engine.game_over:
+                break
+    return mismatches
+
+
+def record_game(seed: int, choose: Callable[[Engine], int], max_ticks: int = 100000) -> Tuple[Engine, Replay]:
+    """ Plays a game to the end with a recorder attached, giving it choose(engine) before every tick. """
+    engine = Engine(seed)
+    engine.recorder = ReplayRecorder(engine.seed, engine.randomizer)
+    while not engine.game_over and engine.ticks < max_ticks:
+        action = choose(engine)
+        if action:
+            engine.act(Action(action))
+        if not engine.game_over:
+            engine.tick()
+    return engine, Replay.from_bytes(engine.recorder.to_bytes(engine.ticks))
+
+
+def check_replays(seed: int, games: int = 50) -> int:
+    """ Records games and plays them back, and counts the replays that don't end in the same state.
+        --- The first game hard drops on every tick, so it ends on a hard drop given on its final tick. """
+    rng = random.Random(seed)
+    choices = [0] * len(RANDOM_ACTIONS) * 2 + [int(action) for action in RANDOM_ACTIONS]
+    mismatches = 0
+    for game in range(games):
+        if game == 0:
+            engine, replay = record_game(seed, lambda engine: Action.HARD_DROP)
+        else:
+            engine, replay = record_game(seed + game, lambda engine: rng.choice(choices))
+        if ReplayPlayer(replay).run().snapshot() != engine.snapshot():
+            mismatches += 1
+    return mismatches
+
+
+def check_spectator(seed: int, games: int = 200, steps: int = 3000) -> int:
+    """ Publishes games to a SpectatorServer and counts the steps where a Mirror following its messages has a
+        different board, Tetromino, next Tetromino, score, level or lines from the engine, or a different tick
+        after a message.
+        --- Each step gives up to three actions before a tick, and sometimes no tick at all, so several hard
+            dropped Tetrominoes can stop between messages. Every game starts on a part-filled board.
+        --- Messages are read straight from the server instead of through a socket; one spectator is
+            connected so that any are made. """
+    import socket
+    import time
+    from replay import read_varint
+    from spectator import Mirror, SpectatorServer
+
+    server = SpectatorServer(port=0)
+    server.start()
+    connection = socket.create_connection((server.host, server.port))
+    while not server.subscribers:
+        time.sleep(0.01)
+
+    rng = random.Random(seed)
+    mismatches = 0
+    try:
+        for game_seed in range(seed, seed + games):
+            engine = Engine(game_seed)
+            prefill(engine, np.zeros((engine.board.height, engine.board.width)), np.random.default_rng(game_seed))
+            # A new engine is followed from a keyframe.
+            mirror = Mirror()
+            for step in range(steps):
+                for _ in range(rng.choice([0, 1, 1, 2, 3])):
+                    engine.act(rng.choice(RANDOM_ACTIONS))
+                if rng.random() < 0.2:
+                    continue
+                engine.tick()
+                server.publish(engine)
+                messages = server.pending
+                for _, message in messages:
+                    length, position = read_varint(message, 0)
+                    mirror.apply(message[position:])
+                server.pending = []
+                piece = engine.current_piece
+                if (mirror.board.cells != engine.board.cells or (messages and mirror.tick != engine.ticks)
+                        or (mirror.current_piece.shape, mirror.current_piece.current_rotation,
+                            mirror.current_piece.x, mirror.current_piece.y)
+                        != (piece.shape, piece.current_rotation, piece.x, piece.y)
+                        or mirror.next_piece.shape != engine.next_piece.shape
+                        or (mirror.score, mirror.level, mirror.lines)
+                        != (engine.score.score, engine.score.level, engine.lines_cleared)
+                        or mirror.game_over_cause != engine.game_over_cause):
+                    mismatches += 1
+                if engine.game_over:
+                    break
+    finally:
+        connection.close()
+        server.close()
+    return mismatches
+
+
+CHECKS: Dict[str, Callable[[int], int]] = {"vector_env": check_vector_env, "renderer": check_renderer,
+                                           "replays": check_replays, "spectator": check_spectator}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks that parts of the game that must agree do agree.")
+    parser.add_argument("--only", action="append", choices=list(CHECKS), help="run only this check, can be repeated")
+    parser.add_argument("--seed", type=int, default=1234, help="seed for the games played")
+    args = parser.parse_args()
+
+    failed: List[str] = []
+    for name in args.only or CHECKS:
+        found = CHECKS[name](args.seed)
+        print("{:16} {}".format(name, "ok" if not found else "{} mismatches".format(found)))
+        if found:
+            failed.append(name)
+    sys.exit(1 if failed else 0)
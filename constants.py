@@ -11,6 +11,19 @@ COLOURS = {"blue": ((40, 63, 128), (156, 182, 255)),
 # Tetromino Block Size
 BLOCK_SIZE = 40
 
+# Size of the game area, in blocks.
+BOARD_WIDTH = 10
+BOARD_HEIGHT = 18
+
+# The game runs at a fixed number of logic ticks per second.
+TICKS_PER_SECOND = 60
+
+# Milliseconds between each gravity step, indexed by level.
+GRAVITY_SPEEDS = [500, 450, 400, 350, 300, 250, 200, 150, 50]
+
+# How many times faster gravity is while the down arrow has been pressed.
+SOFT_DROP_MULTIPLIER = 20
+
 # Dictionary containing Tetromino shapes, and their rotations.
 TETROMINO_SHAPES = {"L": [["-----",
                            "-B---",
@@ -88,7 +101,7 @@ TETROMINO_SHAPES = {"L": [["-----",
                            "-----",
                            "-----"],
                           ["-B---",
-                           "-BB-",
+                           "-BB--",
                            "--B--",
                            "-----",
                            "-----"]],
@@ -0,0 +1,267 @@
+import random
+import struct
+import constants
+import events
+import scoring
+import zobrist
+from board import Board
+from pieces import Piece, PieceSource, piece_code, piece_from_code
+from enum import IntEnum
+from typing import List, Optional, Tuple
+
+# A snapshot starts with a header: the magic bytes, the format version and the seed.
+# -- Then STATE: ticks, pieces placed, lines cleared, gravity timer, flags for soft drop and game over,
+#    the game over cause, and the Scoring's score, level and lines towards the next level.
+# -- Then the rows cleared by the last Tetromino, as a count and a byte each, and the current Piece as its
+#    piece_code(), x, y and spawn column.
+# -- Then Board.pack() and PieceSource.pack().
+SNAPSHOT_MAGIC = b"TTSN"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<4sBQ")
+STATE = struct.Struct("<IIIHBBIHB")
+CURRENT_PIECE = struct.Struct("<Bbbb")
+GAME_OVER_CAUSES = (None, "top_out", "lock_out")
+
+
+class Action(IntEnum):
+    """ Inputs the player can give to the game. """
+
+    LEFT = 1
+    RIGHT = 2
+    ROTATE = 3
+    SOFT_DROP = 4
+    # Used for debugging
+    LEVEL_UP = 5
+    # Drops the Tetromino straight to where it lands, and stops it there.
+    HARD_DROP = 6
+
+
+class Engine:
+    """ The rules of the game, with no display or clock.
+        --- The game only moves forward when act() or tick() is called, one tick is one frame at 60 FPS.
+        --- Every random choice comes from the piece source, so two engines with the same seed and the same
+            actions on the same ticks play the same game.
+        --- What happens to the game is announced on events, an events.EventBus, for anything that needs to react
+            to it: drawing, sound or telemetry can subscribe instead of checking the engine every frame. """
+
+    def __init__(self, seed: Optional[int] = None, piece_source: Optional[PieceSource] = None,
+                 randomizer: str = "uniform"):
+        # A seed is always chosen, so the game can be recorded and replayed.
+        if seed is None:
+            seed = random.randrange(2**32)
+        self.seed: int = seed
+        self.pieces: PieceSource = piece_source if piece_source is not None else PieceSource(seed, randomizer)
+        # The name of the randomizer choosing the shapes, so a recording can use the same one.
+        self.randomizer: str = self.pieces.randomizer.name
+
+        self.board: Board = Board()
+        self.score: scoring.Scoring = scoring.Scoring()
+        self.events: events.EventBus = events.EventBus()
+
+        # Milliseconds between gravity steps, by level.
+        self.difficulty: List[int] = list(constants.GRAVITY_SPEEDS)
+        # Ticks between gravity steps, worked out again only when the level changes.
+        self.gravity_ticks: int = self.gravity_interval()
+        self.events.subscribe(events.LEVEL_CHANGED, self.level_changed)
+        # Ticks since the current Tetromino last moved down. Soft drop makes each tick count for more.
+        self.gravity_timer: int = 0
+        # For when the down arrow is pressed, lasts until the Tetromino stops.
+        self.soft_drop: bool = False
+        self.game_over: bool = False
+        # Why the game ended; "top_out" when the stack reaches the top two rows, or "lock_out" when a
+        # Tetromino stops partly above the game area.
+        self.game_over_cause: Optional[str] = None
+
+        self.ticks: int = 0
+        self.pieces_placed: int = 0
+        self.lines_cleared: int = 0
+        # Rows cleared by the last Tetromino to stop, as they were numbered before clearing.
+        self.last_cleared_rows: List[int] = []
+
+        # Set to a ReplayRecorder to log every action.
+        self.recorder = None
+
+        self.current_piece: Optional[Piece] = None
+        self.next_piece: Optional[Piece] = None
+        self.spawn()
+
+    def spawn(self) -> None:
+        """ Moves the next Piece into play at its spawn column, with its lowest block on the top row
+            of the game area. """
+        piece = self.pieces.next_piece()
+        self.next_piece = self.pieces.peek()
+
+        piece.x = piece.spawn_x
+        piece.y = -piece.get_rotation().max_y
+        self.current_piece = piece
+        self.gravity_timer = 0
+        self.events.emit(events.PIECE_SPAWNED, piece)
+
+    def upcoming(self, count: int) -> List[Piece]:
+        """ Returns the next count Pieces to spawn after the current one. """
+        return self.pieces.upcoming(count)
+
+    def state_hash(self) -> int:
+        """ Returns the Zobrist hash of the board and the current Tetromino's shape, rotation and position. """
+        piece = self.current_piece
+        return self.board.hash ^ zobrist.piece_key(piece.shape, piece.current_rotation, piece.x, piece.y)
+
+    def landing_y(self) -> int:
+        """ Returns the row the current Tetromino would stop at if it fell straight down. """
+        piece = self.current_piece
+        return piece.y + self.board.drop_distance(piece.get_cells())
+
+    def gravity_interval(self) -> int:
+        """ Returns the number of ticks between gravity steps at the current level. """
+        level = min(self.score.get_level(), len(self.difficulty) - 1)
+        return max(1, self.difficulty[level] * constants.TICKS_PER_SECOND // 1000)
+
+    def level_changed(self, level: int) -> None:
+        self.gravity_ticks = self.gravity_interval()
+
+    def act(self, action: Action) -> bool:
+        """ Applies one player input to the current Tetromino. Returns true if anything changed. """
+        piece = self.current_piece
+        if self.game_over:
+            return False
+        if self.recorder is not None:
+            self.recorder.record(self.ticks, action)
+        if action == Action.LEFT:
+            if piece.confined("left") and not piece.x_collision("left", self.board):
+                piece.x -= 1
+                return True
+        elif action == Action.RIGHT:
+            if piece.confined("right") and not piece.x_collision("right", self.board):
+                piece.x += 1
+                return True
+        elif action == Action.ROTATE:
+            rotation = piece.next_rotation()
+            if self.board.fits(piece.get_cells(rotation=rotation)):
+                piece.current_rotation = rotation
+                return True
+        elif action == Action.SOFT_DROP:
+            if not self.soft_drop:
+                self.soft_drop = True
+                return True
+        elif action == Action.LEVEL_UP:
+            self.score.increase_level()
+            self.events.emit(events.LEVEL_CHANGED, self.score.level)
+            return True
+        elif action == Action.HARD_DROP:
+            piece.y = self.landing_y()
+            self.stop_current_piece()
+            return True
+        return False
+
+    def tick(self) -> None:
+        """ Advances the game by one tick: stops the Tetromino if it has landed, then applies gravity. """
+        if self.game_over:
+            return
+        self.ticks += 1
+
+        if self.current_piece.y_collision(self.board):
+            self.stop_current_piece()
+            if self.game_over:
+                return
+
+        self.gravity_timer += constants.SOFT_DROP_MULTIPLIER if self.soft_drop else 1
+        if self.gravity_timer >= self.gravity_ticks:
+            if self.current_piece.confined("down"):
+                self.current_piece.y += 1
+            else:
+                self.stop_current_piece()
+            self.gravity_timer = 0
+
+    def stop_current_piece(self) -> None:
+        """ Places the current Tetromino on the board, clears any complete rows, and spawns the next one.
+            --- This is the only place rows are cleared, points are scored or the game ends, so none of it is
+                looked at on ticks where nothing stops. """
+        piece = self.current_piece
+        cells = piece.get_cells()
+        self.board.place(cells, list(constants.COLOURS.keys()).index(piece.colour) + 1)
+        self.pieces_placed += 1
+        self.soft_drop = False
+        self.events.emit(events.PIECE_LOCKED, piece, cells)
+
+        self.last_cleared_rows = self.board.clear_full_rows()
+        if self.last_cleared_rows:
+            level = self.score.level
+            self.lines_cleared += len(self.last_cleared_rows)
+            self.score.increase_score(len(self.last_cleared_rows))
+            self.events.emit(events.LINES_CLEARED, self.last_cleared_rows)
+            if self.score.level != level:
+                self.events.emit(events.LEVEL_CHANGED, self.score.level)
+
+        if self.check_for_game_over(cells):
+            self.events.emit(events.GAME_OVER, self.game_over_cause)
+            return
+        self.spawn()
+
+    def snapshot(self) -> bytes:
+        """ Returns the whole state of the game, which restore() can go back to, here or in another Engine.
+            --- Engines in the same state give the same bytes, and they are safe to save to a file.
+            --- The recorder isn't part of the snapshot. """
+        score = self.score
+        data = bytearray(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.seed))
+        data += STATE.pack(self.ticks, self.pieces_placed, self.lines_cleared, self.gravity_timer,
+                           self.soft_drop | self.game_over << 1, GAME_OVER_CAUSES.index(self.game_over_cause),
+                           score.score, score.level, score.lines_cleared_iterator)
+        data.append(len(self.last_cleared_rows))
+        data += bytes(self.last_cleared_rows)
+        piece = self.current_piece
+        data += CURRENT_PIECE.pack(piece_code(piece), piece.x, piece.y, piece.spawn_x)
+        data += self.board.pack()
+        data += self.pieces.pack()
+        return bytes(data)
+
+    def restore(self, data: bytes) -> None:
+        """ Puts the game back to a snapshot. Raises ValueError if it isn't a snapshot, or is from an
+            unknown version.
+            --- No events are emitted for the jump, so anything following the engine must catch up itself. """
+        if len(data) < SNAPSHOT_HEADER.size + STATE.size + 1:
+            raise ValueError("Snapshot is too short")
+        magic, version, seed = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("Not a snapshot")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported snapshot version {}".format(version))
+        position = SNAPSHOT_HEADER.size
+        (ticks, pieces_placed, lines_cleared, gravity_timer, flags, cause,
+         score, level, level_lines) = STATE.unpack_from(data, position)
+        position += STATE.size
+        cleared = data[position]
+        last_cleared_rows = list(data[position + 1:position + 1 + cleared])
+        position += 1 + cleared
+        if position + CURRENT_PIECE.size > len(data):
+            raise ValueError("Snapshot ended early")
+        code, x, y, spawn_x = CURRENT_PIECE.unpack_from(data, position)
+        position += CURRENT_PIECE.size
+        board, position = Board.unpack(data, position)
+        pieces, position = PieceSource.unpack(data, position)
+
+        self.seed = seed
+        self.ticks, self.pieces_placed, self.lines_cleared = ticks, pieces_placed, lines_cleared
+        self.gravity_timer = gravity_timer
+        self.soft_drop, self.game_over = bool(flags & 1), bool(flags & 2)
+        self.game_over_cause = GAME_OVER_CAUSES[cause]
+        self.score.score, self.score.level, self.score.lines_cleared_iterator = score, level, level_lines
+        self.gravity_ticks = self.gravity_interval()
+        self.last_cleared_rows = last_cleared_rows
+        self.board = board
+        self.pieces = pieces
+        self.randomizer = pieces.randomizer.name
+        self.current_piece = piece_from_code(code, x, y, spawn_x)
+        self.next_piece = pieces.peek()
+
+    def check_for_game_over(self, cells: List[Tuple[int, int]]) -> bool:
+        """ The game is over once static blocks reach the top two rows, or a Tetromino stops
+            partly above the game area. """
+        for x, y in cells:
+            if y < 0:
+                self.game_over = True
+                self.game_over_cause = "lock_out"
+                return self.game_over
+        if self.board.row_counts[0] or self.board.row_counts[1]:
+            self.game_over = True
+            self.game_over_cause = "top_out"
+        return self.game_over
@@ -0,0 +1,38 @@
+from typing import Any, Callable, Dict, List
+
+# Events an Engine emits, and what their handlers are given.
+# -- PIECE_SPAWNED(piece): a Tetromino has come into play.
+# -- PIECE_LOCKED(piece, cells): a Tetromino has stopped and its cells are now part of the board.
+# -- LINES_CLEARED(rows): complete rows were removed, as they were numbered before clearing.
+# -- LEVEL_CHANGED(level): the level went up, from clearing lines or the debug key.
+# -- GAME_OVER(cause): the game has ended, with Engine.game_over_cause.
+PIECE_SPAWNED = "piece_spawned"
+PIECE_LOCKED = "piece_locked"
+LINES_CLEARED = "lines_cleared"
+LEVEL_CHANGED = "level_changed"
+GAME_OVER = "game_over"
+
+
+class EventBus:
+    """ Calls the handlers subscribed to an event whenever it's emitted, in the order they subscribed.
+        --- Handlers run straight away, inside emit(), so they see the engine as it is when the event happens.
+        --- Emitting an event nothing has subscribed to is a single dictionary lookup. """
+
+    def __init__(self):
+        self.handlers: Dict[str, List[Callable[..., Any]]] = {}
+
+    def subscribe(self, event: str, handler: Callable[..., Any]) -> None:
+        self.handlers.setdefault(event, []).append(handler)
+
+    def unsubscribe(self, event: str, handler: Callable[..., Any]) -> None:
+        """ Stops calling handler for event. Raises ValueError if it wasn't subscribed. """
+        handlers = self.handlers.get(event, [])
+        handlers.remove(handler)
+        if not handlers:
+            self.handlers.pop(event, None)
+
+    def emit(self, event: str, *args: Any) -> None:
+        handlers = self.handlers.get(event)
+        if handlers:
+            for handler in handlers:
+                handler(*args)
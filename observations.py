@@ -0,0 +1,129 @@
+import numpy as np
+import pygame
+import constants
+from engine import Engine
+from typing import Optional, Tuple
+
+# Weights for turning red, green and blue into grey, from ITU-R BT.601.
+GREY_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+def pixel_surface(width: int, height: int) -> Tuple[pygame.Surface, np.ndarray]:
+    """ Returns a surface and a (height, width, 3) RGB array of its pixels, which share the same memory.
+        --- Anything drawn on the surface shows up in the array straight away, without copying, and the
+            surface isn't locked by the array, so it can still be blitted to and from. """
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)
+    surface = pygame.image.frombuffer(pixels, (width, height), "RGBX")
+    return surface, pixels[:, :, :3]
+
+
+def block_tiles(block_size: int, grayscale: bool = False) -> np.ndarray:
+    """ Returns an image of each value a board cell can hold, block_size pixels square: the background
+        for an empty cell, then a block of each colour in constants.COLOURS.
+        --- The images are the game's own blocks, smoothly scaled down from constants.BLOCK_SIZE. """
+    from tet_two import BlockAtlas
+
+    size = constants.BLOCK_SIZE
+    tiles = []
+    for colour in (None,) + tuple(constants.COLOURS.keys()):
+        tile = pygame.Surface((size, size))
+        tile.fill(constants.BG_COLOURS.get('off_white'))
+        if colour is not None:
+            tile.blit(BlockAtlas.get(colour), (0, 0))
+        if block_size != size:
+            tile = pygame.transform.smoothscale(tile, (block_size, block_size))
+        tiles.append(pygame.surfarray.array3d(tile).transpose(1, 0, 2))
+    tiles = np.stack(tiles)
+    if grayscale:
+        tiles = (tiles @ np.array(GREY_WEIGHTS)).round().astype(np.uint8)
+    return tiles
+
+
+class FrameHistory:
+    """ Keeps the last size frames in one array, overwriting the oldest.
+        --- A frame can be copied in with push(), or drawn straight into the array through next_slot(). """
+
+    def __init__(self, frame_shape: Tuple[int, ...], size: int, dtype=np.uint8):
+        self.frames: np.ndarray = np.zeros((size,) + tuple(frame_shape), dtype=dtype)
+        self.size: int = size
+        # Frames added so far; the newest is at (count - 1) % size.
+        self.count: int = 0
+
+    def __len__(self) -> int:
+        return min(self.count, self.size)
+
+    def next_slot(self) -> np.ndarray:
+        """ Returns the slot of the oldest frame, and counts it as the newest. Whatever is written to it
+            before the next call is the newest frame. """
+        slot = self.frames[self.count % self.size]
+        self.count += 1
+        return slot
+
+    def push(self, frame: np.ndarray) -> np.ndarray:
+        """ Copies frame in as the newest frame, and returns its slot. """
+        slot = self.next_slot()
+        np.copyto(slot, frame)
+        return slot
+
+    def latest(self, age: int = 0) -> np.ndarray:
+        """ Returns the frame added age frames before the newest one, without copying it. """
+        if not 0 <= age < len(self):
+            raise IndexError("Only {} frames are kept".format(len(self)))
+        return self.frames[(self.count - 1 - age) % self.size]
+
+    def ordered(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """ Returns the frames from oldest to newest. Given out, they're written there instead of to a new array.
+            --- Until the history is full, the missing frames are the first one repeated. """
+        order = np.arange(self.count - self.size, self.count) % self.size
+        if self.count < self.size:
+            order[:self.size - self.count] = 0
+        return np.take(self.frames, order, axis=0, out=out)
+
+    def clear(self) -> None:
+        self.count = 0
+
+
+class BoardObserver:
+    """ Renders an engine's board and falling Tetromino into an array, block_size pixels to a block, without
+        pygame drawing anything.
+        --- Each cell is looked up in images of the game's blocks already scaled to block_size, so small
+            observations cost no more than copying their own pixels.
+        --- Frames are (height, width, 3) RGB, or (height, width) if grayscale. The last history frames
+            are kept in a FrameHistory, and render() draws the next one straight into it. """
+
+    def __init__(self, engine: Engine, block_size: int = constants.BLOCK_SIZE // 10, grayscale: bool = False,
+                 history: int = 1):
+        self.engine: Engine = engine
+        self.block_size: int = block_size
+        self.tiles: np.ndarray = block_tiles(block_size, grayscale)
+
+        board = engine.board
+        channels = self.tiles.shape[3:]
+        self.frame_shape: Tuple[int, ...] = (board.height*block_size, board.width*block_size) + channels
+        self.history: FrameHistory = FrameHistory(self.frame_shape, history)
+        # The board with the falling Tetromino drawn in, and every cell's image, reused for every frame.
+        self.cells: np.ndarray = np.zeros((board.height, board.width), dtype=np.uint8)
+        self.blocks: np.ndarray = np.zeros((board.height, board.width) + self.tiles.shape[1:], dtype=np.uint8)
+
+    def render(self) -> np.ndarray:
+        """ Draws the engine as it is now as the newest frame, and returns it. """
+        engine = self.engine
+        board = engine.board
+        np.copyto(self.cells, np.frombuffer(board.cells, dtype=np.uint8).reshape(board.height, board.width))
+        piece = engine.current_piece
+        value = list(constants.COLOURS.keys()).index(piece.colour) + 1
+        for x, y in piece.get_cells():
+            if y >= 0:
+                self.cells[y, x] = value
+
+        np.take(self.tiles, self.cells, axis=0, out=self.blocks)
+        frame = self.history.next_slot()
+        size = self.block_size
+        # (row, column, y, x) blocks laid out as (row, y, column, x) is the whole frame.
+        np.copyto(frame.reshape((board.height, size, board.width, size) + self.tiles.shape[3:]),
+                  self.blocks.swapaxes(1, 2))
+        return frame
+
+    def frames(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """ Returns the last history frames, oldest first. """
+        return self.history.ordered(out)
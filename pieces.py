@@ -0,0 +1,252 @@
+import random
+import struct
+import constants
+import shapes
+from board import Board
+from typing import Dict, List, Optional, Tuple, Type, Union
+
+# Pieces are made this many at a time, ahead of being needed.
+CHUNK_SIZE = 32
+
+COLOUR_NAMES: Tuple[str, ...] = tuple(constants.COLOURS.keys())
+SHAPE_INDEXES: Dict[str, int] = {shape: i for i, shape in enumerate(shapes.SHAPE_NAMES)}
+COLOUR_INDEXES: Dict[str, int] = {colour: i for i, colour in enumerate(COLOUR_NAMES)}
+# The state of a PieceSource's random number generator: 624 words and a position.
+RNG_STATE = struct.Struct("<625I")
+
+
+def piece_code(piece: "Piece") -> int:
+    """ Packs a piece's shape into the low three bits of a byte, its colour into the next two and its
+        rotation above them. """
+    return SHAPE_INDEXES[piece.shape] | COLOUR_INDEXES[piece.colour] << 3 | piece.current_rotation << 5
+
+
+def piece_from_code(code: int, x: int = 0, y: int = 0, spawn_x: int = 0) -> "Piece":
+    """ Returns a Piece from a byte made by piece_code(). """
+    piece = Piece(shapes.SHAPE_NAMES[code & 7], COLOUR_NAMES[code >> 3 & 3], spawn_x)
+    piece.current_rotation = code >> 5
+    piece.x, piece.y = x, y
+    return piece
+
+
+class Piece:
+    """ A Tetromino's shape, colour, rotation and position on the board, without any drawing. """
+
+    def __init__(self, shape: str, colour: str, spawn_x: int = 0):
+        self.shape: str = shape
+        self.colour: str = colour
+        self.current_rotation: int = 0
+        # Grid co-ordinates of the top left of the shape template.
+        # -- These stay at 0 until the Piece spawns, so the next Piece can be drawn from the origin.
+        self.x: int = 0
+        self.y: int = 0
+        # The column the Piece will spawn at.
+        self.spawn_x: int = spawn_x
+
+    def get_cells(self, dx: int = 0, dy: int = 0, rotation: Optional[int] = None) -> List[Tuple[int, int]]:
+        """ Returns the grid co-ordinates of each block, in block ID order.
+            --- dx, dy and rotation can be given to get the cells of a prospective move. """
+        if rotation is None:
+            rotation = self.current_rotation
+        x, y = self.x + dx, self.y + dy
+        return [(x + column, y + row) for column, row in shapes.SHAPES[self.shape][rotation].cells]
+
+    def get_rotation(self) -> shapes.Rotation:
+        """ Returns the compiled footprint of the current rotation. """
+        return shapes.SHAPES[self.shape][self.current_rotation]
+
+    def next_rotation(self) -> int:
+        """ Returns the rotation that follows the current one. """
+        return (self.current_rotation + 1) % len(shapes.SHAPES[self.shape])
+
+    def y_collision(self, board: Board) -> bool:
+        """ Returns true if any block is resting on a static block. """
+        for x, y in self.get_cells(dy=1):
+            if board.is_occupied(x, y):
+                return True
+        return False
+
+    def x_collision(self, direction: str, board: Board) -> bool:
+        """ Returns true if any block would move into a static block. """
+        dx = -1 if direction == "left" else 1
+        for x, y in self.get_cells(dx=dx):
+            if board.is_occupied(x, y):
+                return True
+        return False
+
+    def confined(self, direction) -> bool:
+        """ Returns true unless a block is heading outside of the game area. """
+        rotation = self.get_rotation()
+        if direction == "down":
+            return self.y + rotation.max_y < constants.BOARD_HEIGHT - 1
+        elif direction == "left":
+            return self.x + rotation.min_x > 0
+        elif direction == "right":
+            return self.x + rotation.max_x < constants.BOARD_WIDTH - 1
+        return True
+
+
+class UniformRandomizer:
+    """ Picks every shape independently, so any shape can come up any number of times in a row. """
+
+    name: str = "uniform"
+
+    def next_shape(self, rng: random.Random) -> str:
+        return rng.choice(shapes.SHAPE_NAMES)
+
+    def get_state(self) -> List[str]:
+        """ Returns the shapes the randomizer remembers, for saving. """
+        return []
+
+    def set_state(self, state: List[str]) -> None:
+        pass
+
+
+class BagRandomizer:
+    """ Deals the shapes from a shuffled bag holding one of each, and refills the bag when it's empty.
+        --- Every shape comes up once in every seven pieces, so there are never long droughts. """
+
+    name: str = "bag"
+
+    def __init__(self):
+        self.bag: List[str] = []
+
+    def next_shape(self, rng: random.Random) -> str:
+        if not self.bag:
+            self.bag = list(shapes.SHAPE_NAMES)
+            rng.shuffle(self.bag)
+        return self.bag.pop()
+
+    def get_state(self) -> List[str]:
+        return list(self.bag)
+
+    def set_state(self, state: List[str]) -> None:
+        self.bag = list(state)
+
+
+class HistoryRandomizer:
+    """ Picks shapes at random, but rerolls up to rolls times when the shape is one of the last few dealt.
+        --- Repeats are rare, though still possible, unlike with a bag. """
+
+    name: str = "history"
+
+    def __init__(self, history_size: int = 4, rolls: int = 4):
+        self.history: List[str] = []
+        self.history_size: int = history_size
+        self.rolls: int = rolls
+
+    def next_shape(self, rng: random.Random) -> str:
+        for _ in range(self.rolls):
+            shape = rng.choice(shapes.SHAPE_NAMES)
+            if shape not in self.history:
+                break
+        self.history.append(shape)
+        if len(self.history) > self.history_size:
+            del self.history[0]
+        return shape
+
+    def get_state(self) -> List[str]:
+        return list(self.history)
+
+    def set_state(self, state: List[str]) -> None:
+        self.history = list(state)
+
+
+# Randomizers by name. The order is fixed, as replays store a randomizer by its position.
+RANDOMIZERS: Dict[str, Type] = {"uniform": UniformRandomizer, "bag": BagRandomizer, "history": HistoryRandomizer}
+
+
+class PieceSource:
+    """ Deals out Pieces with a random shape, colour and spawn column, from its own seeded
+        random number generator.
+        --- Shapes are chosen by a randomizer: uniform, bag or history.
+        --- Pieces are made in chunks of chunk_size and queued, so any number of upcoming Pieces can be looked
+            at with peek() or upcoming() without changing what's dealt. """
+
+    def __init__(self, seed: Optional[int] = None, randomizer: Union[str, object] = "uniform",
+                 chunk_size: int = CHUNK_SIZE):
+        self.rng: random.Random = random.Random(seed)
+        self.colours: Tuple[str, ...] = tuple(constants.COLOURS.keys())
+        if isinstance(randomizer, str):
+            if randomizer not in RANDOMIZERS:
+                raise ValueError("Unknown randomizer {!r}".format(randomizer))
+            randomizer = RANDOMIZERS[randomizer]()
+        self.randomizer = randomizer
+        self.chunk_size: int = chunk_size
+
+        # Pieces that haven't been dealt start at queue[head]. Dealt Pieces are dropped a chunk at a time.
+        self.queue: List[Piece] = []
+        self.head: int = 0
+
+    def make_piece(self) -> Piece:
+        """ Returns a new Piece, with a spawn column where it fits between the walls. """
+        shape = self.randomizer.next_shape(self.rng)
+        colour = self.rng.choice(self.colours)
+        rotation = shapes.SHAPES[shape][0]
+        spawn_x = self.rng.choice(range(-rotation.min_x, constants.BOARD_WIDTH - rotation.max_x))
+        return Piece(shape, colour, spawn_x)
+
+    def fill(self, count: int) -> None:
+        """ Makes chunks of Pieces until at least count are queued. """
+        if self.head >= self.chunk_size:
+            del self.queue[:self.head]
+            self.head = 0
+        while len(self.queue) - self.head < count:
+            self.queue.extend(self.make_piece() for _ in range(self.chunk_size))
+
+    def next_piece(self) -> Piece:
+        """ Deals the next Piece. """
+        if self.head >= len(self.queue):
+            self.fill(1)
+        piece = self.queue[self.head]
+        self.head += 1
+        return piece
+
+    def peek(self, index: int = 0) -> Piece:
+        """ Returns the Piece that will be dealt after index more, without dealing it. """
+        if self.head + index >= len(self.queue):
+            self.fill(index + 1)
+        return self.queue[self.head + index]
+
+    def upcoming(self, count: int) -> List[Piece]:
+        """ Returns the next count Pieces, in the order they'll be dealt. """
+        if self.head + count > len(self.queue):
+            self.fill(count)
+        return self.queue[self.head:self.head + count]
+
+    def pack(self) -> bytes:
+        """ Returns everything needed to carry on dealing the same Pieces: the randomizer and what it remembers,
+            the random number generator's state, and the queued Pieces. """
+        state = self.randomizer.get_state()
+        data = bytearray([list(RANDOMIZERS).index(self.randomizer.name), len(state)])
+        data += bytes(SHAPE_INDEXES[shape] for shape in state)
+        data += RNG_STATE.pack(*self.rng.getstate()[1])
+        queued = self.queue[self.head:]
+        data += struct.pack("<HH", self.chunk_size, len(queued))
+        for piece in queued:
+            data += struct.pack("<Bb", piece_code(piece), piece.spawn_x)
+        return bytes(data)
+
+    @classmethod
+    def unpack(cls, data: bytes, position: int = 0) -> Tuple["PieceSource", int]:
+        """ Reads a piece source written by pack(). Returns it and the position after it. """
+        try:
+            names = list(RANDOMIZERS)
+            # Seeded with 0 only to skip asking the OS for a seed; the state is replaced below.
+            source = cls(0, names[data[position]])
+            state_size = data[position + 1]
+            position += 2
+            source.randomizer.set_state([shapes.SHAPE_NAMES[i] for i in data[position:position + state_size]])
+            position += state_size
+            source.rng.setstate((3, RNG_STATE.unpack_from(data, position), None))
+            position += RNG_STATE.size
+            source.chunk_size, queued = struct.unpack_from("<HH", data, position)
+            position += 4
+            for code, spawn_x in struct.iter_unpack("<Bb", data[position:position + 2 * queued]):
+                source.queue.append(piece_from_code(code, spawn_x=spawn_x))
+            position += 2 * queued
+            if len(source.queue) != queued:
+                raise IndexError
+        except (IndexError, struct.error) as error:
+            raise ValueError("Piece source ended early") from error
+        return source, position
@@ -0,0 +1,124 @@
+import numpy as np
+import shapes
+import zobrist
+from board import Board
+from functools import lru_cache
+from typing import Dict, NamedTuple, Tuple, Union
+
+
+class Footprint(NamedTuple):
+    """ A Rotation laid out for dropping with NumPy.
+        --- cx and cy are the block offsets, columns holds each distinct column offset, and bottoms the
+            lowest row offset of a block in that column. """
+
+    cx: np.ndarray
+    cy: np.ndarray
+    columns: np.ndarray
+    bottoms: np.ndarray
+    min_x: int
+    min_y: int
+    max_x: int
+
+
+def compile_footprint(rotation: shapes.Rotation) -> Footprint:
+    """ Works out the lowest block in each column of a Rotation. """
+    cx = np.array([column for column, row in rotation.cells], dtype=np.intp)
+    cy = np.array([row for column, row in rotation.cells], dtype=np.intp)
+    columns = np.unique(cx)
+    bottoms = np.array([cy[cx == column].max() for column in columns], dtype=np.intp)
+    return Footprint(cx, cy, columns, bottoms, rotation.min_x, rotation.min_y, rotation.max_x)
+
+
+FOOTPRINTS: Dict[str, Tuple[Footprint, ...]] = {
+    name: tuple(compile_footprint(rotation) for rotation in rotations) for name, rotations in shapes.SHAPES.items()}
+
+
+class Placements(NamedTuple):
+    """ Every final resting place of a piece, one entry per placement.
+        --- rotation, x and y say where the piece stopped, in the same co-ordinates as Piece.
+        --- boards are the boards after the piece has stopped and any complete rows have been cleared, and hashes
+            their Zobrist hashes, the same as Board.hash would be. """
+
+    rotation: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    boards: np.ndarray
+    lines: np.ndarray
+    holes: np.ndarray
+    aggregate_height: np.ndarray
+    bumpiness: np.ndarray
+    heights: np.ndarray
+    hashes: np.ndarray
+
+
+@lru_cache(maxsize=None)
+def cell_key_array(width: int, height: int) -> np.ndarray:
+    """ Returns zobrist.cell_keys() as a (height, width) array. """
+    return np.array(zobrist.cell_keys(width, height), dtype=np.uint64).reshape(height, width)
+
+
+def board_hashes(grids: np.ndarray) -> np.ndarray:
+    """ Returns the Zobrist hash of each grid in a stack of grids. """
+    count, height, width = grids.shape
+    keys = np.where(grids, cell_key_array(width, height), np.uint64(0))
+    return np.bitwise_xor.reduce(keys.reshape(count, height * width), axis=1)
+
+
+def board_to_array(board: Board) -> np.ndarray:
+    """ Returns the board as a (height, width) array of bools, true where there is a static block. """
+    cells = np.frombuffer(bytes(board.cells), dtype=np.uint8)
+    return cells.reshape(board.height, board.width) != 0
+
+
+def column_heights(grids: np.ndarray) -> np.ndarray:
+    """ Returns the height of the highest block in each column, for one grid or a stack of grids. """
+    height = grids.shape[-2]
+    filled = grids.any(axis=-2)
+    top = grids.argmax(axis=-2)
+    return np.where(filled, height - top, 0)
+
+
+def enumerate_placements(board: Union[Board, np.ndarray], shape: str) -> Placements:
+    """ Drops the piece straight down in every rotation at every column it fits, all in one batch.
+        --- Placements that would leave a block above the game area are left out. """
+    grid = board_to_array(board) if isinstance(board, Board) else np.asarray(board, dtype=bool)
+    height, width = grid.shape
+    # The row index of the highest block in each column, or height for an empty column.
+    top_rows = height - column_heights(grid)
+
+    rotations, xs, ys, cell_rows, cell_columns = [], [], [], [], []
+    for rotation, footprint in enumerate(FOOTPRINTS[shape]):
+        x = np.arange(-footprint.min_x, width - footprint.max_x)
+        # Each column of the piece can fall until its lowest block sits on that column's highest block.
+        falls = top_rows[x[:, None] + footprint.columns[None, :]] - 1 - footprint.bottoms[None, :]
+        y = falls.min(axis=1)
+        on_board = y + footprint.min_y >= 0
+        x, y = x[on_board], y[on_board]
+        rotations.append(np.full(len(x), rotation, dtype=np.intp))
+        xs.append(x)
+        ys.append(y)
+        cell_rows.append(y[:, None] + footprint.cy[None, :])
+        cell_columns.append(x[:, None] + footprint.cx[None, :])
+
+    rotation = np.concatenate(rotations)
+    x = np.concatenate(xs)
+    y = np.concatenate(ys)
+    count = len(x)
+    index = np.arange(count)[:, None]
+
+    boards = np.broadcast_to(grid, (count, height, width)).copy()
+    boards[index, np.concatenate(cell_rows), np.concatenate(cell_columns)] = True
+
+    # Clear complete rows by moving them to the top, keeping the order of the rest, then emptying them.
+    full = boards.all(axis=2)
+    lines = full.sum(axis=1)
+    order = np.argsort(~full, axis=1, kind="stable")
+    boards = np.take_along_axis(boards, order[:, :, None], axis=1)
+    boards[np.arange(height)[None, :] < lines[:, None]] = False
+
+    heights = column_heights(boards)
+    holes = (heights - boards.sum(axis=1)).sum(axis=1)
+    aggregate_height = heights.sum(axis=1)
+    bumpiness = np.abs(np.diff(heights, axis=1)).sum(axis=1)
+    return Placements(rotation, x, y, boards, lines, holes, aggregate_height, bumpiness, heights,
+                      board_hashes(boards))
@@ -0,0 +1,134 @@
+import gc
+import sys
+import time
+from collections import deque
+from typing import Deque, Dict, List, TextIO, Tuple
+
+# Frame times are counted in 1 ms buckets, with everything slower going in the last bucket.
+HISTOGRAM_BUCKETS = 50
+
+
+class FrameProfiler:
+    """ Times each phase of a frame with perf_counter_ns.
+        --- Call start_frame(), then lap(name) at the end of each phase, then end_frame().
+        --- The last window frames are kept for percentiles, and every frame is counted in a histogram
+            of frame times. """
+
+    def __init__(self, window: int = 600):
+        self.window: int = window
+        self.phases: Dict[str, Deque[int]] = {}
+        self.frames: Deque[int] = deque(maxlen=window)
+        self.histogram: List[int] = [0] * (HISTOGRAM_BUCKETS + 1)
+        self.frame_count: int = 0
+
+        self.frame_start: int = 0
+        self.lap_start: int = 0
+        # Sprites and surfaces alive when count_objects() was last called.
+        self.objects: Dict[str, int] = {}
+
+    def reset(self) -> None:
+        """ Forgets every time recorded so far. """
+        self.phases.clear()
+        self.frames.clear()
+        self.histogram = [0] * (HISTOGRAM_BUCKETS + 1)
+        self.frame_count = 0
+
+    def start_frame(self) -> None:
+        self.frame_start = self.lap_start = time.perf_counter_ns()
+
+    def lap(self, name: str) -> None:
+        """ Records the time since the last lap, or the start of the frame, against name. """
+        now = time.perf_counter_ns()
+        times = self.phases.get(name)
+        if times is None:
+            times = self.phases[name] = deque(maxlen=self.window)
+        times.append(now - self.lap_start)
+        self.lap_start = now
+
+    def end_frame(self) -> None:
+        frame_time = time.perf_counter_ns() - self.frame_start
+        self.frames.append(frame_time)
+        self.histogram[min(frame_time // 1000000, HISTOGRAM_BUCKETS)] += 1
+        self.frame_count += 1
+
+    @staticmethod
+    def percentiles(times) -> Tuple[float, float, float]:
+        """ Returns the 50th, 95th and 99th percentile of the times, in milliseconds. """
+        if not times:
+            return 0.0, 0.0, 0.0
+        ordered = sorted(times)
+        last = len(ordered) - 1
+        return tuple(ordered[round(last * p)] / 1e6 for p in (0.5, 0.95, 0.99))
+
+    def count_objects(self) -> Dict[str, int]:
+        """ Counts the pygame sprites and surfaces that are alive. This walks every object, so it's slow. """
+        import pygame
+
+        sprites = 0
+        # Surfaces aren't tracked by the garbage collector, so they're found through the objects that hold them.
+        surfaces = set()
+        for obj in gc.get_objects():
+            if isinstance(obj, pygame.sprite.Sprite):
+                sprites += 1
+            for referent in gc.get_referents(obj):
+                if isinstance(referent, pygame.Surface):
+                    surfaces.add(id(referent))
+        self.objects = {"sprites": sprites, "surfaces": len(surfaces)}
+        return self.objects
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """ Returns the count, mean, percentiles and maximum of each phase and of the whole frame, in ms. """
+        summary = {}
+        for name, times in list(self.phases.items()) + [("frame", self.frames)]:
+            p50, p95, p99 = self.percentiles(times)
+            summary[name] = {"count": len(times),
+                             "mean_ms": sum(times) / len(times) / 1e6 if times else 0.0,
+                             "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+                             "max_ms": max(times) / 1e6 if times else 0.0}
+        return summary
+
+    def export(self, path: str) -> None:
+        """ Writes the summary to path, as CSV if it ends in .csv and otherwise as JSON. """
+        import csv
+        import json
+
+        summary = self.summary()
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as export_file:
+                writer = csv.writer(export_file)
+                writer.writerow(["phase", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"])
+                for name, stats in summary.items():
+                    writer.writerow([name, stats["count"], stats["mean_ms"], stats["p50_ms"], stats["p95_ms"],
+                                     stats["p99_ms"], stats["max_ms"]])
+                writer.writerow([])
+                writer.writerow(["frame_ms", "frames"])
+                for bucket, count in enumerate(self.histogram):
+                    writer.writerow([bucket if bucket < HISTOGRAM_BUCKETS else "{}+".format(bucket), count])
+        else:
+            with open(path, "w") as export_file:
+                json.dump({"frames": self.frame_count,
+                           "phases": summary,
+                           "histogram_ms": self.histogram,
+                           "objects": self.objects}, export_file, indent=2)
+
+
+class StartupProfile:
+    """ Times the stages of starting the game, from when it's created to each call of mark(name).
+        --- It's made before pygame is imported, so the first stage is the time spent importing. """
+
+    def __init__(self):
+        self.start: float = time.perf_counter()
+        self.last: float = self.start
+        self.stages: List[Tuple[str, float]] = []
+
+    def mark(self, name: str) -> None:
+        """ Records the time since the last mark, or since the profile was made, against name. """
+        now = time.perf_counter()
+        self.stages.append((name, (now - self.last) * 1000))
+        self.last = now
+
+    def report(self, output: TextIO = sys.stderr) -> None:
+        """ Writes each stage and the total, in milliseconds. """
+        for name, ms in self.stages:
+            output.write("{:24} {:8.1f} ms\n".format(name, ms))
+        output.write("{:24} {:8.1f} ms\n".format("total", (self.last - self.start) * 1000))
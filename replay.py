@@ -0,0 +1,164 @@
+import struct
+import pieces
+from engine import Engine, Action
+from typing import BinaryIO, List, Tuple
+
+# A replay file starts with a header: the magic bytes, the format version, the seed and a byte for
+# the randomizer, its position in pieces.RANDOMIZERS.
+# -- After the header, each action is stored as the number of ticks since the previous action,
+#    as an unsigned LEB128 varint, followed by a single byte action code.
+# -- The log finishes with END, at the tick the game was stopped.
+MAGIC = b"TTRP"
+# Version 2: soft drop multiplies gravity rather than moving down every tick.
+# Version 3: the randomizer is stored. Version 2 replays were all played with the uniform randomizer.
+VERSION = 3
+HEADER = struct.Struct("<4sBQ")
+END = 0
+
+
+def write_varint(data: bytearray, value: int) -> None:
+    """ Appends an unsigned integer to data, seven bits at a time. """
+    while value >= 0x80:
+        data.append((value & 0x7F) | 0x80)
+        value >>= 7
+    data.append(value)
+
+
+def read_varint(data: bytes, position: int) -> Tuple[int, int]:
+    """ Reads an unsigned integer from data. Returns the value and the position after it. """
+    value = 0
+    shift = 0
+    while True:
+        if position >= len(data):
+            raise ValueError("Replay ended in the middle of a number")
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+class ReplayRecorder:
+    """ Logs the actions given to an engine, with the tick they were given on.
+        --- Attach it with engine.recorder = ReplayRecorder(engine.seed, engine.randomizer). """
+
+    def __init__(self, seed: int, randomizer: str = "uniform"):
+        self.seed: int = seed
+        self.randomizer: str = randomizer
+        self.data: bytearray = bytearray()
+        self.last_tick: int = 0
+
+    def record(self, tick: int, action: int) -> None:
+        """ Adds an action to the log. Ticks must never go backwards. """
+        write_varint(self.data, tick - self.last_tick)
+        self.data.append(action)
+        self.last_tick = tick
+
+    def to_bytes(self, final_tick: int) -> bytes:
+        """ Returns the whole replay, finishing at final_tick. """
+        data = bytearray(HEADER.pack(MAGIC, VERSION, self.seed))
+        data.append(list(pieces.RANDOMIZERS).index(self.randomizer))
+        data += self.data
+        write_varint(data, final_tick - self.last_tick)
+        data.append(END)
+        return bytes(data)
+
+    def save(self, file: BinaryIO, final_tick: int) -> None:
+        file.write(self.to_bytes(final_tick))
+
+
+class Replay:
+    """ A recorded game: the seed and randomizer, every action with its tick, and the tick the game
+        stopped on. """
+
+    def __init__(self, seed: int, actions: List[Tuple[int, Action]], final_tick: int, randomizer: str = "uniform"):
+        self.seed: int = seed
+        self.actions: List[Tuple[int, Action]] = actions
+        self.final_tick: int = final_tick
+        self.randomizer: str = randomizer
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Replay":
+        """ Reads a replay. Raises ValueError if it isn't a replay, or is from an unknown version. """
+        if len(data) < HEADER.size:
+            raise ValueError("Replay is too short to have a header")
+        magic, version, seed = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a replay file")
+        if version not in (2, VERSION):
+            raise ValueError("Unsupported replay version {}".format(version))
+
+        randomizer = "uniform"
+        position = HEADER.size
+        if version >= 3:
+            names = list(pieces.RANDOMIZERS)
+            if position >= len(data) or data[position] >= len(names):
+                raise ValueError("Replay has an unknown randomizer")
+            randomizer = names[data[position]]
+            position += 1
+
+        actions = []
+        tick = 0
+        while True:
+            delta, position = read_varint(data, position)
+            if position >= len(data):
+                raise ValueError("Replay ended without an end marker")
+            code = data[position]
+            position += 1
+            tick += delta
+            if code == END:
+                return cls(seed, actions, tick, randomizer)
+            actions.append((tick, Action(code)))
+
+    @classmethod
+    def load(cls, file: BinaryIO) -> "Replay":
+        return cls.from_bytes(file.read())
+
+
+class ReplayPlayer:
+    """ Feeds a replay's actions into a new engine, tick by tick. """
+
+    def __init__(self, replay: Replay):
+        self.replay: Replay = replay
+        self.engine: Engine = Engine(replay.seed, randomizer=replay.randomizer)
+        self.next_action: int = 0
+
+    def finished(self) -> bool:
+        """ The replay is over at game over, or once the final tick is reached and every action has been given. """
+        if self.engine.game_over:
+            return True
+        actions = self.replay.actions
+        pending = self.next_action < len(actions) and actions[self.next_action][0] <= self.engine.ticks
+        return self.engine.ticks >= self.replay.final_tick and not pending
+
+    def step(self) -> None:
+        """ Gives the engine the actions recorded for the current tick, then advances it one tick.
+            --- At the final tick the actions are given without a tick after them, as the recording stopped
+                there. A hard drop on that tick can still end the game. """
+        actions = self.replay.actions
+        while self.next_action < len(actions) and actions[self.next_action][0] <= self.engine.ticks:
+            self.engine.act(actions[self.next_action][1])
+            self.next_action += 1
+        if self.engine.ticks < self.replay.final_tick:
+            self.engine.tick()
+
+    def run(self) -> Engine:
+        """ Plays the whole replay as fast as possible, without drawing. Returns the engine at the end. """
+        while not self.finished():
+            self.step()
+        return self.engine
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Plays a replay as fast as possible, without a window.")
+    parser.add_argument("replay", help="replay file recorded with tet_two.py --record")
+    args = parser.parse_args()
+
+    with open(args.replay, "rb") as replay_file:
+        player = ReplayPlayer(Replay.load(replay_file))
+    engine = player.run()
+    print("seed {} ticks {} pieces {} score {} level {} game over {}".format(
+        engine.seed, engine.ticks, engine.pieces_placed, engine.score.score, engine.score.level, engine.game_over))
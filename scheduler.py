@@ -0,0 +1,43 @@
+import time
+import constants
+from typing import Callable
+
+
+class FixedTimestep:
+    """ Works out how many logic ticks to run before each rendered frame, so the game runs at the same
+        speed however fast frames are drawn.
+        --- Real time is added to an accumulator, and a tick is taken out of it for every tick that runs.
+        --- When frames are slow, several ticks run before the next frame is drawn. No more than
+            max_ticks_per_frame run at once; any time beyond that is dropped, so the game slows down
+            rather than falling further and further behind. """
+
+    def __init__(self, tick_rate: int = constants.TICKS_PER_SECOND, max_ticks_per_frame: int = 5,
+                 clock: Callable[[], float] = time.perf_counter):
+        self.tick_seconds: float = 1 / tick_rate
+        self.max_ticks_per_frame: int = max_ticks_per_frame
+        self.clock: Callable[[], float] = clock
+
+        self.accumulator: float = 0.0
+        self.last_time: float = clock()
+        # Ticks that were dropped because frames were too slow to catch up.
+        self.dropped_ticks: int = 0
+
+    def reset(self) -> None:
+        """ Forgets any time that has built up, eg. after a pause. """
+        self.accumulator = 0.0
+        self.last_time = self.clock()
+
+    def advance(self) -> int:
+        """ Returns the number of ticks to run for the time since the last call. """
+        now = self.clock()
+        self.accumulator += now - self.last_time
+        self.last_time = now
+
+        ticks = int(self.accumulator / self.tick_seconds)
+        if ticks > self.max_ticks_per_frame:
+            self.dropped_ticks += ticks - self.max_ticks_per_frame
+            ticks = self.max_ticks_per_frame
+            self.accumulator = 0.0
+        else:
+            self.accumulator -= ticks * self.tick_seconds
+        return ticks
@@ -1,14 +1,9 @@
-from tet_two import DisplayText
-
-
 class Scoring:
+    """ Keeps the score and level. Drawing them is left to the display. """
 
-    def __init__(self, surface):
-        self.surface = surface
+    def __init__(self):
         self.score = 0
-        self.score_text = DisplayText((8, 1))
         self.level = 1
-        self.level_text = DisplayText((1, 1))
 
         self.lines_cleared_iterator = 0
 
@@ -17,7 +12,10 @@ class Scoring:
                        '9': [400, 1000, 3000, 3600]}
 
     def increase_score(self, lines_cleared):
-        """ Increases score depending on level and lines cleared. """
+        """ Increases score depending on level and lines cleared.
+            --- Should be called once per Tetromino, with the total number of lines it cleared. """
+        if lines_cleared <= 0:
+            return
 
         # Increases level after 10 lines have been cleared.
         self.lines_cleared_iterator += lines_cleared
@@ -25,25 +23,21 @@ class Scoring:
             self.increase_level()
             self.lines_cleared_iterator = 0
 
-        # Code a little arbitrary, needs closer inspection
-        if self.level == 1 or self.level == 2:
-            if lines_cleared >= len(self.scores.get('1'))+1:
-                self.score += self.scores.get(str(self.get_level))[3]
-            else:
-                self.score += self.scores.get(str(self.level))[lines_cleared-1]
-        elif 2 < self.level < 10:
-            self.score += self.scores.get(str(self.level))[lines_cleared-1]
+        points = self.scores.get(self.get_score_table())
+        self.score += points[min(lines_cleared, len(points)) - 1]
+
+    def get_score_table(self) -> str:
+        """ Returns the key of the score table for the current level.
+            --- Levels without their own table use the table of the closest level below. """
+        key = '1'
+        for level in self.scores.keys():
+            if int(level) <= self.level:
+                key = level
+        return key
 
     def increase_level(self):
         """ Increases level by 1. """
         self.level += 1
 
-    def draw(self):
-        score_obj = self.score_text.display(str(self.score))
-        level_obj = self.level_text.display(str(self.level))
-
-        self.score_text.draw(self.surface, score_obj)
-        self.level_text.draw(self.surface, level_obj)
-
     def get_level(self) -> int:
         return self.level
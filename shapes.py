@@ -0,0 +1,58 @@
+import constants
+from typing import Dict, List, NamedTuple, Tuple
+
+# Every shape template is a square of this many characters.
+TEMPLATE_SIZE = 5
+BLOCKS_PER_SHAPE = 4
+
+
+class Rotation(NamedTuple):
+    """ One rotation of a shape, compiled from its template.
+        --- cells are (column, row) offsets from the top left of the template, in block ID order. """
+
+    cells: Tuple[Tuple[int, int], ...]
+    min_x: int
+    min_y: int
+    max_x: int
+    max_y: int
+
+
+def compile_rotation(template: List[str]) -> Rotation:
+    """ Turns a template of '-' and 'B' strings into a Rotation.
+        --- Raises ValueError if the template is the wrong size, has unknown characters or
+            doesn't have exactly four blocks. """
+    if len(template) != TEMPLATE_SIZE:
+        raise ValueError("Template has {} rows, expected {}: {}".format(len(template), TEMPLATE_SIZE, template))
+
+    cells = []
+    for row, string in enumerate(template):
+        if len(string) != TEMPLATE_SIZE:
+            raise ValueError("Template row {!r} has {} characters, expected {}".format(
+                string, len(string), TEMPLATE_SIZE))
+        for column, char in enumerate(string):
+            if char == 'B':
+                cells.append((column, row))
+            elif char != '-':
+                raise ValueError("Template row {!r} has unknown character {!r}".format(string, char))
+
+    if len(cells) != BLOCKS_PER_SHAPE:
+        raise ValueError("Template has {} blocks, expected {}: {}".format(len(cells), BLOCKS_PER_SHAPE, template))
+
+    columns = [column for column, row in cells]
+    rows = [row for column, row in cells]
+    return Rotation(tuple(cells), min(columns), min(rows), max(columns), max(rows))
+
+
+def compile_shapes(templates: Dict[str, List[List[str]]]) -> Dict[str, Tuple[Rotation, ...]]:
+    """ Compiles every rotation of every shape. """
+    shapes = {}
+    for name, rotations in templates.items():
+        if not rotations:
+            raise ValueError("Shape {!r} has no rotations".format(name))
+        shapes[name] = tuple(compile_rotation(template) for template in rotations)
+    return shapes
+
+
+# Compiled once, when the module is first imported.
+SHAPES: Dict[str, Tuple[Rotation, ...]] = compile_shapes(constants.TETROMINO_SHAPES)
+SHAPE_NAMES: Tuple[str, ...] = tuple(SHAPES.keys())
@@ -0,0 +1,96 @@
+import json
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from engine import Engine, Action
+from replay import Replay
+from typing import Dict, Iterable, List, Optional, TextIO
+
+
+# A policy is anything with an actions(engine) method, returning the actions to give the engine
+# before its next tick.
+
+
+class RandomPolicy:
+    """ Presses a random key on some ticks. """
+
+    def __init__(self, seed: int, rate: float = 0.2):
+        self.rng: random.Random = random.Random(seed)
+        self.rate: float = rate
+        self.actions_to_choose: List[Action] = [Action.LEFT, Action.RIGHT, Action.ROTATE, Action.SOFT_DROP]
+
+    def actions(self, engine: Engine) -> Iterable[Action]:
+        """ Returns the actions to give the engine before its next tick. """
+        if self.rng.random() < self.rate:
+            return [self.rng.choice(self.actions_to_choose)]
+        return []
+
+
+class ScriptedPolicy:
+    """ Gives the engine the actions from a recorded replay, on the ticks they were recorded. """
+
+    def __init__(self, seed: int, script: Replay):
+        self.script: Replay = script
+        self.next_action: int = 0
+
+    def actions(self, engine: Engine) -> Iterable[Action]:
+        actions = []
+        script = self.script.actions
+        while self.next_action < len(script) and script[self.next_action][0] <= engine.ticks:
+            actions.append(script[self.next_action][1])
+            self.next_action += 1
+        return actions
+
+
+def make_policy(name: str, seed: int, script: Optional[bytes] = None, budget_ms: Optional[float] = None):
+    """ Returns the policy with the given name. The script policy needs the bytes of a replay file.
+        --- budget_ms is how long the bot may search for each move. None lets it finish every search, so a
+            game's result depends only on its seed, and not on how busy the machine is. """
+    if name == "random":
+        return RandomPolicy(seed)
+    elif name == "bot":
+        import bot
+
+        return bot.BeamSearchBot(budget_ms=budget_ms)
+    elif name == "script":
+        if script is None:
+            raise ValueError("The script policy needs a replay file")
+        return ScriptedPolicy(seed, Replay.from_bytes(script))
+    raise ValueError("Unknown policy {!r}".format(name))
+
+
+def play_game(seed: int, policy_name: str, max_ticks: int, script: Optional[bytes] = None,
+              randomizer: str = "uniform", budget_ms: Optional[float] = None) -> Dict:
+    """ Plays one game without a window, until game over or max_ticks. Returns its results. """
+    engine = Engine(seed, randomizer=randomizer)
+    policy = make_policy(policy_name, seed, script, budget_ms)
+    while not engine.game_over and engine.ticks < max_ticks:
+        for action in policy.actions(engine):
+            engine.act(action)
+        engine.tick()
+    result = {"seed": seed,
+              "policy": policy_name,
+              "randomizer": randomizer,
+              "score": engine.score.score,
+              "level": engine.score.level,
+              "lines": engine.lines_cleared,
+              "pieces": engine.pieces_placed,
+              "ticks": engine.ticks,
+              "game_over_cause": engine.game_over_cause if engine.game_over else "max_ticks"}
+    # Policies can report their own counters, such as the bot's cache hits.
+    if hasattr(policy, "stats"):
+        result.update(policy.stats())
+    return result
+
+
+def run_campaign(games: int, seed: int, policy_name: str, max_ticks: int, workers: Optional[int] = None,
+                 script: Optional[bytes] = None, output: TextIO = sys.stdout, randomizer: str = "uniform",
+                 budget_ms: Optional[float] = None) -> None:
+    """ Plays games with seeds seed, seed+1, ... across a pool of processes.
+        --- Each result is written to output as a line of JSON as soon as its game finishes. """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(play_game, seed + i, policy_name, max_ticks, script, randomizer, budget_ms)
+                   for i in range(games)]
+        for future in as_completed(futures):
+            output.write(json.dumps(future.result()) + "\n")
+            output.flush()
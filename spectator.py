@@ -0,0 +1,456 @@
+import asyncio
+import struct
+import threading
+import events
+from board import Board
+from engine import GAME_OVER_CAUSES, Engine
+from pieces import COLOUR_INDEXES, Piece, piece_code, piece_from_code
+from replay import read_varint, write_varint
+from typing import List, Optional, Tuple
+
+# A spectator stream is a series of messages, each one a varint length followed by that many bytes.
+# -- The first byte of a message is its type, KEYFRAME or DELTA.
+# -- A keyframe holds the whole game: the tick, the board's width and height and Board.pack(), the current
+#    piece, the next piece, then the score, level and lines as varints, and the game over cause.
+# -- A delta holds the number of ticks since the previous message as a varint, a byte of flags, and then a
+#    field for each flag that is set, in the order of the flags below. Ticks where nothing changed are skipped.
+# -- A piece is three bytes: its shape, colour and rotation packed into one byte, then x and y as signed
+#    bytes. The next piece is only sent as its first byte, as it hasn't got a position yet.
+KEYFRAME = 1
+DELTA = 2
+
+# The current piece, when it moves, rotates or spawns.
+MOVED = 1
+# The number of pieces that stopped, then for each one in order: the piece where it stopped, the number of
+# rows it cleared, and the index each of those rows had before clearing.
+# -- Hard drops stop pieces between ticks, so more than one can stop between messages.
+LOCKED = 2
+# The new next piece.
+SPAWNED = 4
+# The score as a varint.
+SCORE = 8
+# The level as a varint.
+LEVEL = 16
+# The game over cause.
+GAME_OVER = 32
+
+PIECE = struct.Struct("<Bbb")
+DEFAULT_PORT = 7654
+
+
+def pack_piece(piece: Piece) -> bytes:
+    return PIECE.pack(piece_code(piece), piece.x, piece.y)
+
+
+def frame(body: bytes) -> bytes:
+    """ Returns the message with its length in front. """
+    data = bytearray()
+    write_varint(data, len(body))
+    return bytes(data + body)
+
+
+def keyframe(engine: Engine) -> bytes:
+    """ Returns a message holding the whole of the engine's game. """
+    body = bytearray([KEYFRAME])
+    write_varint(body, engine.ticks)
+    body += bytes([engine.board.width, engine.board.height])
+    body += engine.board.pack()
+    body += pack_piece(engine.current_piece)
+    body.append(piece_code(engine.next_piece))
+    write_varint(body, engine.score.score)
+    write_varint(body, engine.score.level)
+    write_varint(body, engine.lines_cleared)
+    body.append(GAME_OVER_CAUSES.index(engine.game_over_cause))
+    return frame(body)
+
+
+class Subscriber:
+    """ A connected spectator, with the messages waiting to be sent to it. """
+
+    def __init__(self, writer: asyncio.StreamWriter, queue_size: int):
+        self.writer: asyncio.StreamWriter = writer
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        # The task sending to it, so it can be waited for on shutdown.
+        self.task: asyncio.Task = asyncio.current_task()
+        # Deltas are no use until a keyframe has been sent, so they're skipped until one is.
+        self.waiting_for_keyframe: bool = True
+
+    def wait_for_keyframe(self) -> None:
+        """ Drops every message queued, and skips deltas until the next keyframe.
+            --- The queue is left empty, so the keyframe always fits. """
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.waiting_for_keyframe = True
+
+
+class SpectatorServer:
+    """ Streams a game to any number of spectators, over TCP on localhost or over a Unix socket.
+        --- The server runs its own asyncio event loop, on a background thread. The game calls publish() after
+            every tick, which only encodes what changed, and flush() once a frame, which hands the frame's
+            messages to the server's thread without waiting for it.
+        --- Each spectator has a queue of at most queue_size messages. When a spectator falls that far behind,
+            its queue is emptied and it's sent a keyframe instead, so a slow spectator skips ahead rather than
+            holding up the game or the other spectators. """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT, path: Optional[str] = None,
+                 queue_size: int = 64):
+        self.host: str = host
+        self.port: int = port
+        self.path: Optional[str] = path
+        self.queue_size: int = queue_size
+
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+        self.thread: Optional[threading.Thread] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        # Only changed on the server's thread.
+        self.subscribers: List[Subscriber] = []
+        # Counted up on the server's thread whenever a spectator needs a keyframe. The game's thread sends one
+        # when it sees the count has changed, so no request is lost between threads.
+        self.keyframe_requests: int = 0
+        self.keyframes_sent_for: int = 0
+
+        # What spectators were last told, to work out the next delta from.
+        self.pending: List[Tuple[bool, bytes]] = []
+        self.last_tick: int = 0
+        self.last_piece: Optional[Piece] = None
+        self.last_position: Tuple[int, int, int] = (0, 0, 0)
+        self.last_score: int = 0
+        self.last_level: int = 0
+        self.last_game_over: bool = False
+        # The engine whose events are followed, and the pieces that stopped since it was last published, each
+        # as the packed piece and the rows it cleared.
+        self.engine: Optional[Engine] = None
+        self.locks: List[Tuple[bytes, List[int]]] = []
+
+        self.keyframes: int = 0
+        self.deltas: int = 0
+        # Times a spectator fell behind and had its queue emptied.
+        self.recoveries: int = 0
+
+    def start(self) -> None:
+        """ Starts listening on a background thread. Raises OSError if the address can't be used. """
+        ready = threading.Event()
+        errors = []
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            try:
+                if self.path is not None:
+                    self.server = self.loop.run_until_complete(asyncio.start_unix_server(self.serve, self.path))
+                else:
+                    self.server = self.loop.run_until_complete(asyncio.start_server(self.serve, self.host,
+                                                                                    self.port))
+                    self.port = self.server.sockets[0].getsockname()[1]
+            except OSError as error:
+                errors.append(error)
+                ready.set()
+                return
+            ready.set()
+            self.loop.run_forever()
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, name="spectator", daemon=True)
+        self.thread.start()
+        ready.wait()
+        if errors:
+            raise errors[0]
+
+    def close(self, timeout: float = 1.0) -> None:
+        """ Disconnects every spectator and stops the server. Spectators are given up to timeout seconds to
+            take what's already been sent to them. """
+        if self.thread is not None and self.thread.is_alive():
+            asyncio.run_coroutine_threadsafe(self.shutdown(timeout), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout)
+
+    async def shutdown(self, timeout: float) -> None:
+        self.server.close()
+        tasks = []
+        for subscriber in self.subscribers:
+            # None tells serve() to stop, after the messages already queued.
+            if subscriber.queue.full():
+                subscriber.queue.get_nowait()
+            subscriber.queue.put_nowait(None)
+            tasks.append(subscriber.task)
+        if tasks:
+            done, stuck = await asyncio.wait(tasks, timeout=timeout)
+            for task in stuck:
+                task.cancel()
+            await asyncio.gather(*stuck, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ Sends a spectator its messages, as fast as it will take them. """
+        subscriber = Subscriber(writer, self.queue_size)
+        self.subscribers.append(subscriber)
+        self.keyframe_requests += 1
+        try:
+            while True:
+                message = await subscriber.queue.get()
+                if message is None:
+                    break
+                writer.write(message)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.subscribers.remove(subscriber)
+            writer.close()
+
+    def broadcast(self, messages: List[Tuple[bool, bytes]]) -> None:
+        """ Queues a frame's messages for every spectator. Runs on the server's thread. """
+        for subscriber in self.subscribers:
+            for is_keyframe, message in messages:
+                if subscriber.waiting_for_keyframe:
+                    if is_keyframe:
+                        subscriber.waiting_for_keyframe = False
+                        subscriber.queue.put_nowait(message)
+                elif not is_keyframe:
+                    try:
+                        subscriber.queue.put_nowait(message)
+                    except asyncio.QueueFull:
+                        # Too far behind; drop everything queued and start again from the next keyframe.
+                        subscriber.wait_for_keyframe()
+                        self.keyframe_requests += 1
+                        self.recoveries += 1
+
+    def resync(self) -> None:
+        """ Sends every spectator a keyframe, for when the engine's state has been replaced rather than played. """
+        self.flush()
+        # There's nothing to work out a delta from, so the next publish() sends a keyframe instead.
+        self.last_piece = None
+        if self.thread is not None and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.request_keyframes)
+
+    def request_keyframes(self) -> None:
+        """ Makes every spectator drop what's queued and wait for a keyframe. Runs on the server's thread.
+            --- What's queued was played before the engine's state was replaced, so it's no use anyway. """
+        for subscriber in self.subscribers:
+            subscriber.wait_for_keyframe()
+        self.keyframe_requests += 1
+
+    def follow(self, engine: Engine) -> None:
+        """ Listens to the engine's events instead of the last engine's, and sends a keyframe of it next. """
+        if self.engine is not None:
+            self.engine.events.unsubscribe(events.PIECE_LOCKED, self.piece_locked)
+            self.engine.events.unsubscribe(events.LINES_CLEARED, self.lines_cleared)
+        self.engine = engine
+        engine.events.subscribe(events.PIECE_LOCKED, self.piece_locked)
+        engine.events.subscribe(events.LINES_CLEARED, self.lines_cleared)
+        self.locks = []
+        self.last_piece = None
+
+    def piece_locked(self, piece: Piece, cells: List[Tuple[int, int]]) -> None:
+        self.locks.append((pack_piece(piece), []))
+
+    def lines_cleared(self, rows: List[int]) -> None:
+        self.locks[-1] = (self.locks[-1][0], list(rows))
+
+    def publish(self, engine: Engine) -> None:
+        """ Encodes what changed in the engine since it was last published. Call it after every tick. """
+        if engine is not self.engine:
+            self.follow(engine)
+        if not self.subscribers:
+            self.locks = []
+            return
+        keyframe_requests = self.keyframe_requests
+        if self.last_piece is not None:
+            message = self.delta(engine)
+            if message is not None:
+                self.pending.append((False, message))
+                self.deltas += 1
+        if keyframe_requests != self.keyframes_sent_for or self.last_piece is None:
+            self.keyframes_sent_for = keyframe_requests
+            self.pending.append((True, keyframe(engine)))
+            self.keyframes += 1
+            self.last_tick = engine.ticks
+        self.remember(engine)
+
+    def flush(self) -> None:
+        """ Hands the messages published since the last flush to the server's thread. Call it once a frame. """
+        if self.pending:
+            self.loop.call_soon_threadsafe(self.broadcast, self.pending)
+            self.pending = []
+
+    def delta(self, engine: Engine) -> Optional[bytes]:
+        """ Returns a message with what changed since the engine was last published, or None if nothing did. """
+        flags = 0
+        fields = bytearray()
+        piece = engine.current_piece
+        position = (piece.x, piece.y, piece.current_rotation)
+        spawned = piece is not self.last_piece
+
+        if spawned or position != self.last_position:
+            flags |= MOVED
+            fields += pack_piece(piece)
+        if self.locks:
+            flags |= LOCKED
+            fields.append(len(self.locks))
+            for locked, rows in self.locks:
+                fields += locked
+                fields.append(len(rows))
+                fields += bytes(rows)
+        if spawned:
+            flags |= SPAWNED
+            fields.append(piece_code(engine.next_piece))
+        if engine.score.score != self.last_score:
+            flags |= SCORE
+            write_varint(fields, engine.score.score)
+        if engine.score.level != self.last_level:
+            flags |= LEVEL
+            write_varint(fields, engine.score.level)
+        if engine.game_over and not self.last_game_over:
+            flags |= GAME_OVER
+            fields.append(GAME_OVER_CAUSES.index(engine.game_over_cause))
+        if not flags:
+            return None
+
+        body = bytearray([DELTA])
+        write_varint(body, engine.ticks - self.last_tick)
+        body.append(flags)
+        body += fields
+        self.last_tick = engine.ticks
+        return frame(body)
+
+    def remember(self, engine: Engine) -> None:
+        """ Keeps the state spectators now know about, for the next delta. """
+        piece = engine.current_piece
+        self.last_piece = piece
+        self.last_position = (piece.x, piece.y, piece.current_rotation)
+        self.locks = []
+        self.last_score = engine.score.score
+        self.last_level = engine.score.level
+        self.last_game_over = engine.game_over
+
+
+class Mirror:
+    """ Rebuilds a game from a spectator stream, for showing it somewhere else.
+        --- Give apply() each message, without its length. Deltas are ignored until the first keyframe. """
+
+    def __init__(self):
+        self.synced: bool = False
+        self.tick: int = 0
+        self.board: Board = Board()
+        self.current_piece: Optional[Piece] = None
+        self.next_piece: Optional[Piece] = None
+        self.score: int = 0
+        self.level: int = 0
+        self.lines: int = 0
+        self.game_over_cause: Optional[str] = None
+        # Pieces seen stopping since the first keyframe.
+        self.pieces_placed: int = 0
+        # Rows cleared by the last piece that stopped in the last message, as they were numbered before clearing.
+        self.last_cleared_rows: List[int] = []
+
+    def apply(self, message: bytes) -> None:
+        """ Updates the game from a message. Raises ValueError if the message isn't understood. """
+        if not message:
+            raise ValueError("Empty message")
+        if message[0] == KEYFRAME:
+            self.apply_keyframe(message)
+        elif message[0] == DELTA:
+            if self.synced:
+                self.apply_delta(message)
+        else:
+            raise ValueError("Unknown message type {}".format(message[0]))
+
+    def apply_keyframe(self, message: bytes) -> None:
+        self.tick, position = read_varint(message, 1)
+        width, height = message[position], message[position + 1]
+        self.board, position = Board.unpack(message, position + 2, width, height)
+        byte, x, y = PIECE.unpack_from(message, position)
+        self.current_piece = piece_from_code(byte, x, y)
+        self.next_piece = piece_from_code(message[position + PIECE.size])
+        position += PIECE.size + 1
+        self.score, position = read_varint(message, position)
+        self.level, position = read_varint(message, position)
+        self.lines, position = read_varint(message, position)
+        self.game_over_cause = GAME_OVER_CAUSES[message[position]]
+        self.last_cleared_rows = []
+        self.synced = True
+
+    def apply_delta(self, message: bytes) -> None:
+        ticks, position = read_varint(message, 1)
+        self.tick += ticks
+        flags = message[position]
+        position += 1
+        self.last_cleared_rows = []
+        if flags & MOVED:
+            byte, x, y = PIECE.unpack_from(message, position)
+            moved = piece_from_code(byte, x, y)
+            position += PIECE.size
+        if flags & LOCKED:
+            locks = message[position]
+            position += 1
+            for _ in range(locks):
+                byte, x, y = PIECE.unpack_from(message, position)
+                locked = piece_from_code(byte, x, y)
+                position += PIECE.size
+                self.board.place(locked.get_cells(), COLOUR_INDEXES[locked.colour] + 1)
+                self.pieces_placed += 1
+                count = message[position]
+                self.last_cleared_rows = list(message[position + 1:position + 1 + count])
+                position += 1 + count
+                if count:
+                    self.board.clear_full_rows()
+                    self.lines += count
+        if flags & MOVED:
+            self.current_piece = moved
+        if flags & SPAWNED:
+            self.next_piece = piece_from_code(message[position])
+            position += 1
+        if flags & SCORE:
+            self.score, position = read_varint(message, position)
+        if flags & LEVEL:
+            self.level, position = read_varint(message, position)
+        if flags & GAME_OVER:
+            self.game_over_cause = GAME_OVER_CAUSES[message[position]]
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    """ Reads one message from a spectator stream, without its length. """
+    length = 0
+    shift = 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return await reader.readexactly(length)
+        shift += 7
+
+
+async def spectate(host: str = "127.0.0.1", port: int = DEFAULT_PORT, path: Optional[str] = None) -> None:
+    """ Follows a game, printing a line whenever a piece stops. """
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    mirror = Mirror()
+    placed = 0
+    try:
+        while True:
+            message = await read_message(reader)
+            mirror.apply(message)
+            if message[0] == KEYFRAME or mirror.pieces_placed != placed:
+                placed = mirror.pieces_placed
+                print("tick {} score {} level {} lines {} cleared {} filled {}".format(
+                    mirror.tick, mirror.score, mirror.level, mirror.lines, mirror.last_cleared_rows,
+                    sum(mirror.board.row_counts)))
+            if mirror.game_over_cause is not None:
+                print("game over: {}".format(mirror.game_over_cause))
+                return
+    except asyncio.IncompleteReadError:
+        print("The game was closed")
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Follows a game started with tet_two.py --spectate.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--path", help="Unix socket to connect to, instead of a port")
+    args = parser.parse_args()
+    asyncio.run(spectate(args.host, args.port, args.path))
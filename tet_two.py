@@ -1,99 +1,159 @@
+from profiler import FrameProfiler, StartupProfile
+
+# Times how long the game takes to start, for --startup-profile. Made first, so it includes the imports.
+STARTUP: StartupProfile = StartupProfile()
+
+import time
 import pygame
-import random
+STARTUP.mark("import pygame")
+
 import constants
+import events
+from collections import OrderedDict
 import scoring
-from typing import Union, Any, List, Set, Dict, Tuple, Optional
+from engine import Engine, Action
+from pieces import Piece, RANDOMIZERS
+from replay import Replay, ReplayPlayer, ReplayRecorder
+from scheduler import FixedTimestep
+from typing import List, Dict, Tuple, Optional
+STARTUP.mark("import game")
 
 
-class SetupGame:
-    """ This class will setup and handle the running of the game. """
+# How often the window is drawn in fast forward.
+FAST_FORWARD_DRAW_SECONDS = 0.25
+# Most upcoming Tetrominoes that fit down the side of the game area, 4 blocks apart.
+MAX_PREVIEW = 4
 
-    def __init__(self):
-        pygame.init()
+
+class SetupGame:
+    """ This class will setup the display and handle input.
+        --- The rules of the game are run by an Engine. A FixedTimestep decides how many ticks it's advanced
+            by before each frame, so gameplay speed doesn't depend on the framerate.
+        --- In fast forward the engine runs as fast as it can, and the window is only drawn a few times
+            a second.
+        --- Each phase of the loop is timed by a FrameProfiler. [ shows the timings on screen, ] starts them
+            again, and given a profile_path they are saved there when the game is closed.
+        --- Drawing is done by a Renderer, which only sends the parts of the window that changed to the display.
+        --- Given a record_path, every action is logged and saved there when the game is closed.
+            Given a replay, its actions are played back instead of taking them from the keyboard.
+            Given an autoplay policy, such as bot.BeamSearchBot, it plays instead of the keyboard.
+        --- preview is the number of upcoming Tetrominoes shown, and randomizer picks how their shapes are
+            chosen; see pieces.RANDOMIZERS.
+        --- Given a spectator.SpectatorServer, every tick is published to it, for other screens to follow.
+        --- Up or W hard drops the falling Tetromino, and G shows or hides the ghost of where it will land.
+        --- R restarts the game from a snapshot taken when it began. F5 keeps a snapshot of the game and F9
+            goes back to it, except while recording, as a replay can't follow a jump.
+        --- Only the display is started here. Fonts start the first time text is drawn, and the rest of
+            pygame, such as sound and joysticks, is never started.
+        --- offscreen draws everything to a surface that's never shown, so no window is opened. The game area
+            and upcoming Tetromino window are then also NumPy arrays, game_area_pixels and
+            next_tetromino_pixels, which always hold what was last drawn; see observations.pixel_surface(). """
+
+    def __init__(self, seed: Optional[int] = None, record_path: Optional[str] = None,
+                 replay: Optional[Replay] = None, autoplay=None, fast_forward: bool = False,
+                 profile_path: Optional[str] = None, preview: int = 1, randomizer: str = "uniform",
+                 spectator=None, offscreen: bool = False):
+        pygame.display.init()
+        STARTUP.mark("display init")
+
+        self.profiler: FrameProfiler = FrameProfiler()
+        self.profile_path: Optional[str] = profile_path
 
         self.clock: pygame.time.Clock = pygame.time.Clock()
-        # The timer is used to regulate the speed of gameplay.
-        # self.gameplay_speed can be diminished to increase the speed of gameplay.
-        self.timer: int = pygame.time.get_ticks()
+        self.scheduler: FixedTimestep = FixedTimestep()
+        self.fast_forward: bool = fast_forward
 
         # Defining size of application window; includes peripherals eg, score and upcoming Tetromino
         self.main_window_size: Tuple = (18*constants.BLOCK_SIZE, 22*constants.BLOCK_SIZE)
-        self.main_window: pygame.Surface = pygame.display.set_mode(self.main_window_size)
-        self.main_window.fill(constants.BG_COLOURS.get("light_grey"))
-        pygame.display.set_caption("Tetris")
-
-        # Creating surfaces for gameplay and the display window for the next Tetromino.
-        self.game_area: pygame.Surface = pygame.Surface((10*constants.BLOCK_SIZE, 18*constants.BLOCK_SIZE))
-        self.game_area.fill(constants.BG_COLOURS.get("off_white"))
-        self.next_tetromino_window: pygame.Surface = pygame.Surface((5*constants.BLOCK_SIZE, 5*constants.BLOCK_SIZE))
-        self.next_tetromino_window.fill(constants.BG_COLOURS.get("off_white"))
-
-        # Set up scoring for game
-        self.score: scoring.Scoring = scoring.Scoring(self.main_window)
-
-        # Set speed by level of game
-        self.difficulty: List[int] = [500, 450, 400, 350, 300, 250, 200, 150, 50]
-        self.gameplay_speed: int = self.difficulty[(self.score.get_level())]
-        # For when the down arrow is pressed
-        self.increase_speed: bool = False
-        self.game_over: bool = False
-        self.game_over_text: Optional[str] = None
-
-        # Attributes to hold the appropriate Tetromino
-        self.current_tetromino: Optional[Tetromino] = None
-        self.next_tetromino: Optional[Tetromino] = None
-        # A group to hold all the blocks once they become static
-        # -- After the Tetromino is stationary the Blocks will be removed and the Tetromino will be discarded.
-        self.static_blocks: pygame.sprite.Group = pygame.sprite.Group()
-        # A group to hold any sprite that has been discarded (blocks, tetrominoes, hitboxes).
-        # -- Anything in this group will be deleted during each iteration of the loop.
-        self.discarded_sprites: pygame.sprite.Group = pygame.sprite.Group()
-
-        self.create_tets()
+        self.offscreen: bool = offscreen
+        if offscreen:
+            self.main_window: pygame.Surface = pygame.Surface(self.main_window_size)
+        else:
+            self.main_window: pygame.Surface = pygame.display.set_mode(self.main_window_size)
+            pygame.display.set_caption("Tetris")
+        STARTUP.mark("window")
+
+        # The game itself; board, Tetrominoes, gravity and scoring.
+        self.replay_player: Optional[ReplayPlayer] = None
+        if replay is not None:
+            self.replay_player = ReplayPlayer(replay)
+            self.engine: Engine = self.replay_player.engine
+        else:
+            self.engine: Engine = Engine(seed, randomizer=randomizer)
+        self.autoplay = autoplay
+        self.spectator = spectator
+        self.record_path: Optional[str] = record_path
+        if record_path is not None:
+            self.engine.recorder = ReplayRecorder(self.engine.seed, self.engine.randomizer)
+        self.score: scoring.Scoring = self.engine.score
+        # Snapshots of the engine, for restarting and for the save slot.
+        self.start_snapshot: bytes = self.engine.snapshot()
+        self.saved_snapshot: Optional[bytes] = None
+        STARTUP.mark("engine")
+
+        self.renderer: Renderer = Renderer(self.main_window, self.engine, preview, pixel_arrays=offscreen)
+        # Surfaces for gameplay and the display window for the upcoming Tetrominoes.
+        self.game_area: pygame.Surface = self.renderer.game_area
+        self.next_tetromino_window: pygame.Surface = self.renderer.next_tetromino_window
+        self.game_area_pixels = self.renderer.game_area_pixels
+        self.next_tetromino_pixels = self.renderer.next_tetromino_pixels
+        # The overlay goes a block below the upcoming Tetrominoes, however many of them are shown.
+        preview_rect = self.next_tetromino_window.get_rect(topleft=self.renderer.next_tetromino_position)
+        self.profiler_overlay: ProfilerOverlay = ProfilerOverlay(self.main_window,
+                                                                 preview_rect.bottom + constants.BLOCK_SIZE)
+        STARTUP.mark("renderer")
 
     def loop(self) -> None:
-        self.event_handling()
-        pygame.display.update()
+        profiler = self.profiler
+        profiler.start_frame()
 
-        self.gameplay_speed = self.difficulty[(self.score.get_level())]
-
-        # Draw the game area and fill with background colour.
-        self.main_window.fill(constants.BG_COLOURS.get('light_grey'))
-        self.main_window.blit(self.game_area, (1*constants.BLOCK_SIZE, 2*constants.BLOCK_SIZE))
-        self.main_window.blit(self.next_tetromino_window, (12 * constants.BLOCK_SIZE, 2 * constants.BLOCK_SIZE))
-        self.game_area.fill(constants.BG_COLOURS.get('off_white'))
-        self.next_tetromino_window.fill(constants.BG_COLOURS.get('off_white'))
-
-        if self.current_tetromino.y_collision(self.static_blocks.sprites()):
-            self.stop_current_tet()
-        self.current_tetromino.draw(self.game_area)
-        self.next_tetromino.draw(self.next_tetromino_window)
-        for block in self.static_blocks.sprites():
-            block.draw(self.game_area)
-        self.score.draw()
-
-        self.gravity()
-
-        self.check_line_completion()
-
-        if self.check_for_game_over():
-            if self.game_over_text is None:
-                self.game_over_text = GameOver(self.game_area)
-            # todo - not working
-            self.game_over_text.draw()
+        self.event_handling()
+        profiler.lap("events")
+
+        if self.fast_forward:
+            # Run ticks until it's time to show the window again.
+            draw_time = time.perf_counter() + FAST_FORWARD_DRAW_SECONDS
+            while time.perf_counter() < draw_time and not self.engine.game_over:
+                self.step()
+            self.scheduler.reset()
+        else:
+            for _ in range(self.scheduler.advance()):
+                self.step()
+        if self.spectator is not None:
+            self.spectator.flush()
+        profiler.lap("logic")
+
+        dirty_rects = self.renderer.draw()
+        if self.main_window.get_rect() in dirty_rects:
+            # The whole window was drawn again, over the overlay too.
+            self.profiler_overlay.invalidate()
+        profiler.lap("render")
+        dirty_rects.extend(self.profiler_overlay.draw(profiler, self.renderer.tetromino_pool))
+        profiler.lap("overlay")
+
+        if not self.offscreen:
+            pygame.display.update(dirty_rects)
+        profiler.lap("display_update")
 
-        self.discarded_sprites.empty()
         # Framerate
-        self.clock.tick(60)
+        if not self.fast_forward:
+            self.clock.tick(60)
+        profiler.lap("wait")
+        profiler.end_frame()
         return
 
-    def create_tets(self):
-        if self.next_tetromino is None:
-            self.next_tetromino = Tetromino()
-        if self.current_tetromino is None:
-            self.current_tetromino = self.next_tetromino
-            self.current_tetromino.set_starting_coordinates()
-            self.next_tetromino = Tetromino()
+    def step(self) -> None:
+        """ Runs one tick of the game, taking actions from the replay or autoplay if there is one. """
+        if self.replay_player is not None:
+            if not self.replay_player.finished():
+                self.replay_player.step()
+        else:
+            if self.autoplay is not None:
+                for action in self.autoplay.actions(self.engine):
+                    self.engine.act(action)
+            self.engine.tick()
+        if self.spectator is not None:
+            self.spectator.publish(self.engine)
 
     def event_handling(self):
         """ This handles all keyboard and mouse events from user """
@@ -102,123 +162,485 @@ class SetupGame:
             if event.type == pygame.QUIT or (
                     event.type == pygame.KEYDOWN and (
                     event.key == pygame.K_ESCAPE)):
-                pygame.quit()
-                quit()
-            elif event.type == pygame.KEYDOWN:
+                self.quit()
+            elif event.type == pygame.VIDEORESIZE or event.type == pygame.VIDEOEXPOSE:
+                # The window contents may have been lost, so everything is drawn again.
+                self.renderer.invalidate()
+                self.profiler_overlay.invalidate()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_f:
+                self.fast_forward = not self.fast_forward
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_g:
+                self.renderer.ghost = not self.renderer.ghost
+                self.renderer.invalidate()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_LEFTBRACKET:
+                # Used for debugging
+                self.profiler_overlay.toggle()
+                if not self.profiler_overlay.visible:
+                    # Whatever the overlay covered is drawn again.
+                    self.renderer.invalidate()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_RIGHTBRACKET:
+                # Used for debugging
+                self.profiler.reset()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_r and self.replay_player is None:
+                self.restore(self.start_snapshot)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F5 and self.replay_player is None:
+                self.saved_snapshot = self.engine.snapshot()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F9 and self.replay_player is None:
+                if self.saved_snapshot is not None and self.engine.recorder is None:
+                    self.restore(self.saved_snapshot)
+            elif event.type == pygame.KEYDOWN and self.replay_player is None and self.autoplay is None:
                 if event.key == pygame.K_DOWN or event.key == pygame.K_s:
-                    if self.increase_speed:
-                        pass
-                    else:
-                        self.toggle_gravity_speed()
+                    self.engine.act(Action.SOFT_DROP)
                 if event.key == pygame.K_SPACE:
-                    self.current_tetromino.rotate()
+                    self.engine.act(Action.ROTATE)
+                elif event.key == pygame.K_UP or event.key == pygame.K_w:
+                    self.engine.act(Action.HARD_DROP)
                 elif event.key == pygame.K_o:
                     pass
                 elif event.key == pygame.K_p:
-                    self.score.increase_level()
-                elif event.key == pygame.K_LEFTBRACKET:
-                    # Used for debugging
-                    # YHitbox.toggle_draw()
-                    pass
-                elif event.key == pygame.K_RIGHTBRACKET:
-                    # Used for debugging
-                    # XHitbox.toggle_draw()
-                    pass
+                    self.engine.act(Action.LEVEL_UP)
                 elif event.key == pygame.K_LEFT or event.key == pygame.K_a:
-                    if not self.current_tetromino.x_collision('left', self.static_blocks):
-                        if self.current_tetromino.confined('left'):
-                            self.current_tetromino.move_left()
+                    self.engine.act(Action.LEFT)
                 elif event.key == pygame.K_RIGHT or event.key == pygame.K_d:
-                    if not self.current_tetromino.x_collision('right', self.static_blocks):
-                        if self.current_tetromino.confined('right'):
-                            self.current_tetromino.move_right()
-
-    def gravity(self):
-        if self.game_over_text is None:
-            if self.timer < (pygame.time.get_ticks() - self.gameplay_speed):
-                if self.current_tetromino.confined("down"):
-                    self.current_tetromino.move_down()
-                else:
-                    self.stop_current_tet()
-                self.timer = pygame.time.get_ticks()
-
-    def toggle_gravity_speed(self):
-
-        if self.increase_speed:
-            self.difficulty[(self.score.get_level())] += 500
-            self.increase_speed = False
+                    self.engine.act(Action.RIGHT)
+
+    def restore(self, snapshot: bytes) -> None:
+        """ Puts the game back to a snapshot, and draws it all again. """
+        self.engine.restore(snapshot)
+        if self.engine.recorder is not None:
+            # Only the start can be restored while recording, so the recording starts again too.
+            self.engine.recorder = ReplayRecorder(self.engine.seed, self.engine.randomizer)
+        self.renderer.reset()
+        self.profiler_overlay.invalidate()
+        if self.spectator is not None:
+            self.spectator.resync()
+        self.scheduler.reset()
+
+    def quit(self):
+        """ Saves the recording and profile, if there are any, and closes the game. """
+        if self.engine.recorder is not None:
+            with open(self.record_path, "wb") as record_file:
+                self.engine.recorder.save(record_file, self.engine.ticks)
+        if self.profile_path is not None:
+            self.profiler.count_objects()
+            self.profiler.objects.update(self.renderer.tetromino_pool.stats())
+            self.profiler.export(self.profile_path)
+        if self.spectator is not None:
+            self.spectator.close()
+        pygame.quit()
+        quit()
+
+
+class Renderer:
+    """ Draws the engine's state onto the main window, and keeps track of which parts have changed.
+        --- draw() returns the rects of the window that need updating, for pygame.display.update().
+        --- Only the cells the falling Tetromino has left or entered are redrawn each frame. Everything is
+            drawn again after invalidate(), or when rows are cleared.
+        --- It follows the engine's events to know when Tetrominoes spawn and stop, rows are cleared, the score
+            or level changes and the game ends, so on other frames only the falling Tetromino is looked at.
+        --- Static blocks are kept on their own layer, which is only changed when a Tetromino stops or rows
+            are cleared. Redrawing part of the game area is a copy from that layer.
+        --- The next preview Tetrominoes are shown one above the other, and drawn again when one spawns.
+        --- With ghost, an outline shows where the falling Tetromino would land. It's found from the board's
+            column heights, so it costs a few lookups a frame.
+        --- With pixel_arrays, the game area and upcoming Tetromino window draw into NumPy arrays, which can
+            be read at any time without copying or locking the surfaces. """
+
+    def __init__(self, main_window: pygame.Surface, engine: Engine, preview: int = 1, pixel_arrays: bool = False,
+                 ghost: bool = True):
+        if not 1 <= preview <= MAX_PREVIEW:
+            raise ValueError("preview must be from 1 to {}".format(MAX_PREVIEW))
+        self.main_window: pygame.Surface = main_window
+        self.engine: Engine = engine
+        self.preview: int = preview
+        self.ghost: bool = ghost
+
+        # Where the game area and the next Tetromino window sit in the main window.
+        self.game_area_position: Tuple[int, int] = (1*constants.BLOCK_SIZE, 2*constants.BLOCK_SIZE)
+        self.next_tetromino_position: Tuple[int, int] = (12*constants.BLOCK_SIZE, 2*constants.BLOCK_SIZE)
+
+        game_area_size = (constants.BOARD_WIDTH*constants.BLOCK_SIZE, constants.BOARD_HEIGHT*constants.BLOCK_SIZE)
+        # Each upcoming Tetromino is centred in a space 5 blocks wide and 4 high, with half a block above and below.
+        next_tetromino_size = (5*constants.BLOCK_SIZE, (4*preview + 1)*constants.BLOCK_SIZE)
+        # (height, width, 3) RGB views of the two surfaces, with pixel_arrays.
+        self.game_area_pixels = None
+        self.next_tetromino_pixels = None
+        if pixel_arrays:
+            from observations import pixel_surface
+
+            self.game_area, self.game_area_pixels = pixel_surface(*game_area_size)
+            self.next_tetromino_window, self.next_tetromino_pixels = pixel_surface(*next_tetromino_size)
+        else:
+            self.game_area: pygame.Surface = pygame.Surface(game_area_size)
+            self.next_tetromino_window: pygame.Surface = pygame.Surface(next_tetromino_size)
+        # The background and every static block, the same size as the game area.
+        self.stack_layer: pygame.Surface = pygame.Surface(self.game_area.get_size())
+        self.score_display: ScoreDisplay = ScoreDisplay(self.main_window)
+        self.game_over_text: Optional[GameOver] = None
+
+        # Sprite used to draw the engine's current Tetromino, reused from a pool.
+        self.tetromino_pool: TetrominoPool = TetrominoPool()
+        self.current_tetromino: Optional[Tetromino] = None
+        # The block image for each colour, used to draw every static block on the board.
+        # -- The board stores colours by their position in constants.COLOURS, starting at 1.
+        BlockAtlas.load()
+        self.static_blocks: Dict[int, pygame.Surface] = {}
+        for i, colour in enumerate(constants.COLOURS.keys()):
+            self.static_blocks[i + 1] = BlockAtlas.get(colour)
+
+        # What was on screen after the last draw, to compare against: the falling Tetromino, and its ghost
+        # where it would land.
+        self.drawn_cells: List[Tuple[int, int]] = []
+        self.ghost_cells: List[Tuple[int, int]] = []
+        self.full_redraw: bool = True
+        self.rebuild_stack: bool = True
+
+        # What the engine's events say has happened since the last draw: the cells of each Tetromino that
+        # stopped, the row above which cleared rows moved the stack, and whether a Tetromino spawned or the
+        # score or level changed.
+        self.locked_cells: List[Tuple[int, int]] = []
+        self.cleared_bottom: int = 0
+        self.spawned: bool = True
+        self.score_changed: bool = True
+        engine.events.subscribe(events.PIECE_SPAWNED, self.piece_spawned)
+        engine.events.subscribe(events.PIECE_LOCKED, self.piece_locked)
+        engine.events.subscribe(events.LINES_CLEARED, self.lines_cleared)
+        engine.events.subscribe(events.LEVEL_CHANGED, self.level_changed)
+        engine.events.subscribe(events.GAME_OVER, self.game_over)
+
+    def piece_spawned(self, piece: Piece) -> None:
+        self.spawned = True
+
+    def piece_locked(self, piece: Piece, cells: List[Tuple[int, int]]) -> None:
+        self.locked_cells.extend(cells)
+
+    def lines_cleared(self, rows: List[int]) -> None:
+        # Rows below the lowest cleared row haven't moved.
+        self.cleared_bottom = max(self.cleared_bottom, rows[-1] + 1)
+        self.score_changed = True
+
+    def level_changed(self, level: int) -> None:
+        self.score_changed = True
+
+    def game_over(self, cause: str) -> None:
+        self.game_over_text = GameOver(self.game_area)
+        self.full_redraw = True
+
+    def invalidate(self) -> None:
+        """ Makes the next draw() redraw and update the whole window, including the static block layer. """
+        self.full_redraw = True
+        self.rebuild_stack = True
+
+    def reset(self) -> None:
+        """ Forgets what was drawn, for when the engine has been put back to a snapshot. """
+        self.game_over_text = GameOver(self.game_area) if self.engine.game_over else None
+        self.locked_cells = []
+        self.cleared_bottom = 0
+        self.spawned = True
+        self.invalidate()
+
+    def draw(self) -> List[pygame.Rect]:
+        """ Brings the window up to date with the engine, and returns the rects that changed. """
+        engine = self.engine
+        dirty_cells = set()
+
+        if self.rebuild_stack:
+            self.draw_stack_rows(0, engine.board.height)
+            self.rebuild_stack = False
         else:
-            self.difficulty[(self.score.get_level())] -= 500
-            self.increase_speed = True
-
-    def check_line_completion(self):
-        """ Checks for line completion. """
-        array_of_blocks_in_line = []
-        lines_to_clear = 0
-        for i in range(18):
-            for block in self.static_blocks.sprites():
-                if block.get_y() == i:
-                    array_of_blocks_in_line.append(block)
-                if len(array_of_blocks_in_line) >= 10:
-                    lines_to_clear += 1
-                    self.remove_blocks(array_of_blocks_in_line)
-                    array_of_blocks_in_line.clear()
-                    self.move_blocks_down(i)
-                    self.score.increase_score(lines_to_clear)
-            array_of_blocks_in_line.clear()
-
-    def remove_blocks(self, array_of_blocks):
-        """ Removes blocks in the given array from the game. """
-        for bloc in array_of_blocks:
-            self.discarded_sprites.add(bloc)
-            self.static_blocks.remove(bloc)
-
-    def move_blocks_down(self, above_this_line):
-        for block in self.static_blocks.sprites():
-            y = block.get_y()
-            if y <= above_this_line:
-                block.move_down()
-
-    def check_for_game_over(self) -> bool:
-        """ Checks if any static block has reached the top of the game area. """
-        for block in self.static_blocks.sprites():
-            if block.get_y() <= 1:
-                self.game_over = True
-        return self.game_over
-
-    def stop_current_tet(self):
-        """ Shrinks the hitbox, stops the tet, removes the blocks and adds to static_blocks, and discards the tet.
-            Set's current_tet to None so when create_tets() is called the game will progress.
-            Toggles the fast gravity it the down arrow has been used. """
-        self.current_tetromino.shrink_y_hitbox()
-        self.current_tetromino.add_blocks_to_group(self.static_blocks)
-        self.discarded_sprites.add(self.current_tetromino)
-        self.current_tetromino = None
-
-        self.toggle_gravity_speed()
-        self.create_tets()
+            if self.cleared_bottom:
+                self.draw_stack_rows(0, self.cleared_bottom)
+                self.full_redraw = True
+            if self.locked_cells:
+                # Stopped Tetrominoes are now part of the board. Each one was last drawn falling, or not at all
+                # if several stopped since the last frame, and is drawn where it stopped. Any that rows were
+                # cleared under have just been drawn with the rows they moved down with.
+                self.draw_stack_cells(self.locked_cells)
+                dirty_cells.update(self.drawn_cells)
+                dirty_cells.update(self.ghost_cells)
+                dirty_cells.update(self.locked_cells)
+        self.locked_cells = []
+        self.cleared_bottom = 0
+
+        if self.create_tets() or self.full_redraw:
+            self.draw_next_tetromino()
+            dirty_rects = [self.next_tetromino_window.get_rect(topleft=self.next_tetromino_position)]
+        else:
+            dirty_rects = []
+
+        if self.full_redraw:
+            return self.draw_everything()
+
+        # Only cells that gained or lost a block of the Tetromino or of its ghost have changed. When the
+        # Tetromino falls a row the ghost stays put, so the area to draw stays small. The ghost can only
+        # move when the Tetromino moves or the board changes, and a new Tetromino can spawn on the same cells.
+        cells = self.current_tetromino.piece.get_cells()
+        if cells != self.drawn_cells or dirty_cells:
+            dirty_cells.update(set(cells).symmetric_difference(self.drawn_cells))
+            ghost_cells = self.find_ghost_cells()
+            dirty_cells.update(set(ghost_cells).symmetric_difference(self.ghost_cells))
+            self.drawn_cells = cells
+            self.ghost_cells = ghost_cells
+        if dirty_cells:
+            dirty_rects.append(self.draw_cells(dirty_cells))
+
+        if self.score_changed:
+            dirty_rects.extend(self.score_display.draw(self.engine.score))
+            self.score_changed = False
+        return dirty_rects
+
+    def draw_everything(self) -> List[pygame.Rect]:
+        """ Redraws every surface and returns the rect of the whole window. """
+        self.full_redraw = False
+
+        self.game_area.blit(self.stack_layer, (0, 0))
+        self.drawn_cells = self.current_tetromino.piece.get_cells()
+        self.ghost_cells = self.find_ghost_cells()
+        self.draw_falling()
+        if self.game_over_text is not None:
+            # todo - not working
+            self.game_over_text.draw()
+        self.draw_next_tetromino()
+
+        self.main_window.fill(constants.BG_COLOURS.get('light_grey'))
+        self.main_window.blit(self.game_area, self.game_area_position)
+        self.main_window.blit(self.next_tetromino_window, self.next_tetromino_position)
+        self.score_display.draw(self.engine.score, True)
+        self.score_changed = False
+        return [self.main_window.get_rect()]
+
+    def draw_cells(self, cells) -> pygame.Rect:
+        """ Redraws the given cells of the game area, and copies them to the main window.
+            --- Returns the area of the main window that changed. """
+        board = self.engine.board
+        size = constants.BLOCK_SIZE
+        area = None
+        for x, y in cells:
+            if not board.in_bounds(x, y) or y < 0:
+                continue
+            cell_rect = pygame.Rect(x*size, y*size, size, size)
+            self.game_area.blit(self.stack_layer, cell_rect, cell_rect)
+            area = cell_rect if area is None else area.union(cell_rect)
+        if area is None:
+            return pygame.Rect(self.game_area_position, (0, 0))
+        # Blocks of the falling Tetromino and its ghost may overlap the redrawn cells, so they're drawn again on top.
+        self.draw_falling()
+
+        self.main_window.blit(self.game_area, area.move(self.game_area_position), area)
+        return area.move(self.game_area_position)
+
+    def find_ghost_cells(self) -> List[Tuple[int, int]]:
+        """ Returns the cells the falling Tetromino would land on, or none if the ghost isn't shown. """
+        if not self.ghost or self.engine.game_over:
+            return []
+        piece = self.current_tetromino.piece
+        return piece.get_cells(dy=self.engine.landing_y() - piece.y)
+
+    def draw_falling(self) -> None:
+        """ Draws the ghost at ghost_cells, then the falling Tetromino over it, on the game area. """
+        size = constants.BLOCK_SIZE
+        image = BlockAtlas.get_ghost(self.current_tetromino.piece.colour)
+        for x, y in self.ghost_cells:
+            if y >= 0:
+                self.game_area.blit(image, (x*size, y*size))
+        self.current_tetromino.draw(self.game_area)
+
+    def draw_stack_rows(self, top: int, bottom: int) -> None:
+        """ Redraws the static block layer from row top up to, but not including, row bottom. """
+        board = self.engine.board
+        size = constants.BLOCK_SIZE
+        self.stack_layer.fill(constants.BG_COLOURS.get('off_white'),
+                              pygame.Rect(0, top*size, board.width*size, (bottom - top)*size))
+        for i in range(top*board.width, bottom*board.width):
+            value = board.cells[i]
+            if value:
+                y, x = divmod(i, board.width)
+                self.stack_layer.blit(self.static_blocks[value], (x*size, y*size))
+
+    def draw_stack_cells(self, cells) -> None:
+        """ Draws the static blocks at the given cells onto the static block layer. """
+        board = self.engine.board
+        size = constants.BLOCK_SIZE
+        for x, y in cells:
+            if board.is_occupied(x, y):
+                self.stack_layer.blit(self.static_blocks[board.cells[y*board.width + x]], (x*size, y*size))
+
+    def draw_next_tetromino(self) -> None:
+        """ Redraws the upcoming Tetrominoes and copies them to the main window.
+            --- They're drawn straight from the block images, as they never move. """
+        size = constants.BLOCK_SIZE
+        self.next_tetromino_window.fill(constants.BG_COLOURS.get('off_white'))
+        for i, piece in enumerate(self.engine.upcoming(self.preview)):
+            rotation = piece.get_rotation()
+            left = (5*size - (rotation.max_x - rotation.min_x + 1)*size) // 2 - rotation.min_x*size
+            top = size // 2 + 4*size*i + (4*size - (rotation.max_y - rotation.min_y + 1)*size) // 2 \
+                - rotation.min_y*size
+            image = BlockAtlas.get(piece.colour)
+            for column, row in rotation.cells:
+                self.next_tetromino_window.blit(image, (left + column*size, top + row*size))
+        self.main_window.blit(self.next_tetromino_window, self.next_tetromino_position)
+
+    def create_tets(self) -> bool:
+        """ Makes sure the Tetromino sprite is drawing the engine's current Piece.
+            --- Returns true if a new Tetromino has spawned. """
+        if not self.spawned:
+            return False
+        self.spawned = False
+        if self.current_tetromino is not None:
+            self.tetromino_pool.release(self.current_tetromino)
+        self.current_tetromino = self.tetromino_pool.acquire(self.engine.current_piece)
+        return True
+
+
+class Fonts:
+    """ Loads each (face, size) of font once, and shares it with everything that draws text.
+        --- Rendered text is kept in a small least recently used cache, keyed by the font, string and colour.
+            The surfaces are shared, so they mustn't be drawn on. """
+
+    fonts: Dict[Tuple[Optional[str], int], pygame.font.Font] = {}
+    rendered: "OrderedDict[Tuple, pygame.Surface]" = OrderedDict()
+    cache_size: int = 64
+
+    @classmethod
+    def get(cls, size: int = 20, face: Optional[str] = None) -> pygame.font.Font:
+        """ Returns the font, loading it the first time. A face of None is pygame's default font. """
+        font = cls.fonts.get((face, size))
+        if font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            font = pygame.font.Font(face if face is not None else pygame.font.get_default_font(), size)
+            cls.fonts[(face, size)] = font
+        return font
+
+    @classmethod
+    def render(cls, text: str, colour: Tuple[int, int, int], size: int = 20,
+               face: Optional[str] = None) -> pygame.Surface:
+        """ Returns the text rendered in the font, reusing an earlier render of the same text if there is one. """
+        key = (face, size, text, colour)
+        surface = cls.rendered.get(key)
+        if surface is not None:
+            cls.rendered.move_to_end(key)
+            return surface
+        surface = cls.get(size, face).render(text, True, colour)
+        cls.rendered[key] = surface
+        if len(cls.rendered) > cls.cache_size:
+            cls.rendered.popitem(last=False)
+        return surface
 
 
 class DisplayText:
+    """ Text at a position in blocks. The font is loaded the first time text is rendered. """
 
     def __init__(self, xy: tuple):
-        pygame.font.init()
-        default_font: str = pygame.font.get_default_font()
-        self.font = pygame.font.Font(default_font, 20)
-
-        self.text = self.display('')
-        self.rect = self.text.get_rect()
+        self.text: Optional[pygame.Surface] = None
         x, y = xy
-        self.rect.x = x * constants.BLOCK_SIZE
-        self.rect.y = y * constants.BLOCK_SIZE
+        self.rect = pygame.Rect(x * constants.BLOCK_SIZE, y * constants.BLOCK_SIZE, 0, 0)
 
     def display(self, text):
-        return self.font.render(text, True, constants.BG_COLOURS.get('dark_grey'))
+        return Fonts.render(text, constants.BG_COLOURS.get('dark_grey'), 20)
 
     def draw(self, surface, text_obj):
         self.text = text_obj
         surface.blit(self.text, self.rect)
 
+    def get_rect(self) -> pygame.Rect:
+        """ Returns the area covered by the text that was last drawn. """
+        if self.text is None:
+            return pygame.Rect(self.rect.topleft, (0, 0))
+        return self.text.get_rect(topleft=self.rect.topleft)
+
+
+class ScoreDisplay:
+    """ Draws the score and level from a Scoring object.
+        --- Text is only rendered again when its value changes. """
+
+    def __init__(self, surface):
+        self.surface = surface
+        self.score_text = DisplayText((8, 1))
+        self.level_text = DisplayText((1, 1))
+        self.drawn_score: Optional[str] = None
+        self.drawn_level: Optional[str] = None
+
+    def draw(self, score: scoring.Scoring, force: bool = False) -> List[pygame.Rect]:
+        """ Draws any value that has changed, or both if force is true. Returns the rects that changed. """
+        dirty_rects = []
+        if force or str(score.score) != self.drawn_score:
+            self.drawn_score = str(score.score)
+            dirty_rects.append(self.replace_text(self.score_text, self.drawn_score))
+        if force or str(score.level) != self.drawn_level:
+            self.drawn_level = str(score.level)
+            dirty_rects.append(self.replace_text(self.level_text, self.drawn_level))
+        return dirty_rects
+
+    def replace_text(self, text: DisplayText, string: str) -> pygame.Rect:
+        """ Covers the old text with the background colour and draws the new text. """
+        old_rect = text.get_rect()
+        self.surface.fill(constants.BG_COLOURS.get('light_grey'), old_rect)
+        text.draw(self.surface, text.display(string))
+        return old_rect.union(text.get_rect())
+
+
+class ProfilerOverlay:
+    """ Shows the FrameProfiler's timings in the corner of the main window, from top down to the bottom edge.
+        --- top should be below anything the Renderer draws there, such as the upcoming Tetrominoes.
+        --- The text is only rendered again every refresh_frames frames. """
+
+    def __init__(self, surface, top: int = 8*constants.BLOCK_SIZE, refresh_frames: int = 30):
+        self.surface = surface
+        self.rect = pygame.Rect(12*constants.BLOCK_SIZE, top, 6*constants.BLOCK_SIZE, surface.get_height() - top)
+        self.refresh_frames: int = refresh_frames
+
+        self.visible: bool = False
+        self.needs_clearing: bool = False
+        self.frames_until_refresh: int = 0
+
+    def toggle(self) -> None:
+        self.visible = not self.visible
+        self.needs_clearing = not self.visible
+        self.frames_until_refresh = 0
+
+    def invalidate(self) -> None:
+        """ Makes the next draw() draw the overlay again, if it's visible. """
+        self.frames_until_refresh = 0
+
+    def draw(self, profiler: FrameProfiler, pool: Optional["TetrominoPool"] = None) -> List[pygame.Rect]:
+        """ Draws the timings, and the pool's counters if there is one, if it's time to refresh them.
+            Returns the rects that changed. """
+        if not self.visible:
+            if self.needs_clearing:
+                self.needs_clearing = False
+                self.surface.fill(constants.BG_COLOURS.get('light_grey'), self.rect)
+                return [self.rect]
+            return []
+
+        self.frames_until_refresh -= 1
+        if self.frames_until_refresh > 0:
+            return []
+        self.frames_until_refresh = self.refresh_frames
+        # Counting objects is slow, so it's done on every tenth refresh.
+        if profiler.frame_count % (self.refresh_frames * 10) < self.refresh_frames:
+            profiler.count_objects()
+
+        lines = ["phase  p50 / p95 / p99 ms"]
+        for name, stats in profiler.summary().items():
+            lines.append("{}  {:.2f} / {:.2f} / {:.2f}".format(name, stats["p50_ms"], stats["p95_ms"], stats["p99_ms"]))
+        for name, count in profiler.objects.items():
+            lines.append("{}  {}".format(name, count))
+        if pool is not None:
+            for name, count in pool.stats().items():
+                lines.append("{}  {}".format(name, count))
+
+        self.surface.fill(constants.BG_COLOURS.get('light_grey'), self.rect)
+        font = Fonts.get(12)
+        y = self.rect.y
+        for line in lines:
+            text = font.render(line, True, constants.BG_COLOURS.get('dark_grey'))
+            self.surface.blit(text, (self.rect.x, y), pygame.Rect(0, 0, self.rect.width, self.rect.bottom - y))
+            y += font.get_linesize()
+            if y >= self.rect.bottom:
+                break
+        return [self.rect]
+
 
 class GameOver:
 
@@ -233,161 +655,79 @@ class GameOver:
         self.text.draw(self.surface, text_obj)
 
 
-class YHitbox(pygame.sprite.Sprite):
-    """ Used for Y-Axis collision detection. """
+class BlockAtlas:
+    """ One pre-rendered block image for each colour, shared by every Block.
+        --- Images are converted to the display's pixel format when a display has been set up. """
 
-    draw_hitbox = False
-
-    def __init__(self):
-        pygame.sprite.Sprite.__init__(self)
-        self.image = pygame.Surface((20, 54))
-        self.rect = self.image.get_rect()
-        self.image.fill((152, 251, 152))
-        # self.draw_hitbox = False
+    images: Dict[str, pygame.Surface] = {}
+    ghost_images: Dict[str, pygame.Surface] = {}
 
     @classmethod
-    def toggle_draw(cls):
-        """ When called will toggle the self.draw_hitbox bool. """
-        if cls.draw_hitbox:
-            cls.draw_hitbox = False
-        else:
-            cls.draw_hitbox = True
-
-    def draw(self, surface, xy):
-        """ Draws the Hitbox onto the given surface.
-            --- Sets the correct position.
-            --- Draw used only for testing. """
-        self.set_x(xy[0])
-        self.set_y(xy[1])
-        if self.draw_hitbox:
-            surface.blit(self.image, self.rect)
-        else:
-            return
-
-    def shrink_size(self):
-        """ Reduces the size of the hitbox so that the underneath of a block won't stop the moving Tet. """
-        x, y = self.rect.x, self.rect.y
-        self.image = pygame.Surface((20, 27))
-        self.rect = self.image.get_rect()
-        self.set_x(x)
-        self.set_y(y)
-        self.image.fill((152, 251, 152))
-
-    def get_hitbox_rect(self) -> object:
-        return self.rect
-
-    def get_x(self) -> int:
-        """ Returns the X co-ordinate of the Hitbox. """
-        return self.rect.x
-
-    def get_y(self) -> int:
-        """ Returns the Y co-ordinate of the Hitbox. """
-        return self.rect.y
+    def load(cls) -> None:
+        """ Renders the image for every colour in constants.COLOURS. """
+        for colour in constants.COLOURS.keys():
+            cls.get(colour)
 
-    def set_x(self, x) -> None:
-        """ Sets the X co-ordinate of the Hitbox. """
-        self.rect.x = x
-
-    def set_y(self, y) -> None:
-        """ Sets the Y co-ordinate of the Hitbox. """
-        self.rect.y = y
-
-
-class XHitbox(YHitbox):
-    """ Used for X-Axis collision detection. """
-
-    draw_hitbox = False
+    @classmethod
+    def get(cls, colour: str) -> pygame.Surface:
+        """ Returns the image for the given colour, rendering it the first time it's needed. """
+        image = cls.images.get(colour)
+        if image is None:
+            image = cls.render(colour)
+            cls.images[colour] = image
+        return image
 
-    def __init__(self):
-        super().__init__()
-        self.image = pygame.Surface((20, 20))
-        self.image.fill((43, 169, 255))
+    @classmethod
+    def get_ghost(cls, colour: str) -> pygame.Surface:
+        """ Returns the ghost image for the given colour, rendering it the first time it's needed. """
+        image = cls.ghost_images.get(colour)
+        if image is None:
+            image = cls.render(colour, ghost=True)
+            cls.ghost_images[colour] = image
+        return image
+
+    @staticmethod
+    def render(colour: str, ghost: bool = False) -> pygame.Surface:
+        """ Draws a block with a dark border and a light center, or for a ghost, the border alone. """
+        dark, light = constants.COLOURS.get(colour)
+        if ghost:
+            light = constants.BG_COLOURS.get('off_white')
+        # Block is (39, 39) so that there is a 2px gap between each block.
+        image = pygame.Surface((39, 39))
+        image.fill(dark)
+        image.fill(light, pygame.Rect(2, 2, 35, 35))
+        if pygame.display.get_surface() is not None:
+            image = image.convert()
+        return image
 
 
 class Block(pygame.sprite.Sprite):
+    """ A single block of a Tetromino. The image is shared with every other block of the same colour. """
 
-    def __init__(self, colour, identification):
+    def __init__(self, colour: str, identification):
         pygame.sprite.Sprite.__init__(self)
         # self.ID used to identify blocks when they're being drawn.
         self.ID = identification
 
-        # Block is (39, 39) so that there is a 2px gap between each block.
-        self.image = pygame.Surface((39, 39))
-        # self.center is filled with a different colour to self image to create a border.
-        self.center = pygame.Surface((35, 35))
+        self.colour: str = colour
+        self.image: pygame.Surface = BlockAtlas.get(colour)
         self.rect = self.image.get_rect()
-        # Unpacking the colour tuple and filling the two surfaces.
-        self.dark, self.light = colour
-        self.image.fill(self.dark)
-        self.center.fill(self.light)
 
-        # Create the hitboxes.
-        self.y_hitbox = YHitbox()
-        self.left_x_hitbox = XHitbox()
-        self.right_x_hitbox = XHitbox()
+    def set_colour(self, colour: str) -> None:
+        """ Changes the block to the given colour, for when it's reused. """
+        if colour != self.colour:
+            self.colour = colour
+            self.image = BlockAtlas.get(colour)
 
     def draw(self, surface: pygame.Surface, x_and_y: Optional[list] = None):
         """ Draws the block on the given surface and at the given co-ordinates.
             --- If the x_and_y argument is None, the block is no longer part of a Tetromino,
-                and should be drawn at the co-ordinates it currently occupies.
-            --- Here we also call the draw() method on the two Hitboxes. """
-
-        if x_and_y is None:
-            # Drawing the center surface onto the image surface to create the border.
-            self.image.blit(self.center, (2, 2))
-            # Now draw the whole image to the given surface.
-            x, y = self.get_x(True), self.get_y(True)
-            surface.blit(self.image, [x, y])
-        else:
+                and should be drawn at the co-ordinates it currently occupies. """
+
+        if x_and_y is not None:
             self.set_x(x_and_y[0], True)
             self.set_y(x_and_y[1], True)
-            self.image.blit(self.center, (2, 2))
-            surface.blit(self.image, self.rect)
-
-        # Draw the hitboxes
-        self.y_hitbox.draw(surface, [self.get_x(True)+10, self.get_y(True)-7])
-        self.left_x_hitbox.draw(surface, [self.get_x(True) - 7, self.get_y(True) + 10])
-        self.right_x_hitbox.draw(surface, [self.get_x(True) + 28, self.get_y(True) + 10])
-
-    def y_collision_detection(self, group: pygame.sprite.Group) -> bool:
-        """ Iterates through a group of blocks, and returns true if the block has collided with any
-            other other block on the Y axis. """
-        for block in group:
-            if self.y_hitbox.rect.colliderect(block.y_hitbox.get_hitbox_rect()):
-                return True
-
-    def x_collision_detection(self, direction: str, group: pygame.sprite.Group) -> bool:
-        """ Iterates through a group of blocks, and returns true if the block has collided with any
-            other other block on the Y axis. """
-        if direction == "left":
-            for block in group:
-                if self.left_x_hitbox.rect.colliderect(block.right_x_hitbox.get_hitbox_rect()):
-                    return True
-        elif direction == "right":
-            for block in group:
-                if self.right_x_hitbox.rect.colliderect(block.left_x_hitbox.get_hitbox_rect()):
-                    return True
-
-    def move_down(self) -> None:
-        self.rect.y += constants.BLOCK_SIZE
-
-    def shrink_hitbox(self) -> None:
-        """ Calls the Y hitbox's shrink_size() method. """
-        self.y_hitbox.shrink_size()
-
-    def get_x(self, return_raw_data: bool = False) -> int:
-        """ Returns the X co-ordinate of the Block. """
-        if return_raw_data:
-            return self.rect.x
-        else:
-            return self.rect.x // constants.BLOCK_SIZE
-
-    def get_y(self, return_raw_data: bool = False) -> int:
-        """ Returns the Y co-ordinate of the Block. """
-        if return_raw_data:
-            return self.rect.y
-        else:
-            return self.rect.y // constants.BLOCK_SIZE
+        surface.blit(self.image, self.rect)
 
     def set_x(self, x, parse_raw_data: bool = False) -> None:
         """ Sets the X co-ordinate of the Block. """
@@ -409,28 +749,17 @@ class Block(pygame.sprite.Sprite):
 
 
 class Tetromino(pygame.sprite.Sprite):
+    """ Draws a Piece from the engine as four Blocks. """
 
-    def __init__(self):
+    def __init__(self, piece: Piece):
         pygame.sprite.Sprite.__init__(self)
 
-        # Surface is (160, 160) because the shape templates are that big.
-        self.image = pygame.Surface((160, 160))
-        self.rect = self.image.get_rect()
-        self.set_x(0)
-        self.set_y(0)
-
-        # Pick a random colour for the Tetromino
-        self.colour: tuple = constants.COLOURS.get(random.choice(list(constants.COLOURS.keys())))
-
-        # Integer to hold current rotation of Tetromino.
-        self.current_rotation: int = 0
+        self.piece: Piece = piece
+        self.colour: str = piece.colour
 
         # Group to hold the blocks with make up the Tetromino
         self.blocks: pygame.sprite.Group = pygame.sprite.Group()
 
-        # Randomly assign the shape of the Tetromino.
-        self.shape: str = random.choice(list(constants.TETROMINO_SHAPES.keys()))
-
         # Create the blocks
         self.create_blocks()
 
@@ -440,125 +769,127 @@ class Tetromino(pygame.sprite.Sprite):
             new_block = Block(self.colour, i)
             self.blocks.add(new_block)
 
-    def set_starting_coordinates(self) -> None:
-        """ Randomly chooses the X coordinate and sets the Tetrominoes coordinates. """
-        done: bool = False
-        while not done:
-            self.set_x(random.choice(range(-1, 9)))
-            # todo - something really wrong here...
-            if self.is_outside_game_area():
-                continue
-            else:
-                done = True
-        self.set_y(-3)
-
-    def y_collision(self, static_tetrominoes: pygame.sprite.Group) -> bool:
+    def reset(self, piece: Piece) -> None:
+        """ Makes the Tetromino draw another Piece, keeping its blocks. """
+        self.piece = piece
+        self.colour = piece.colour
         for block in self.blocks.sprites():
-            if block.y_collision_detection(static_tetrominoes):
-                return True
-
-    def x_collision(self, direction: str, static_tetrominoes: pygame.sprite.Group) -> bool:
-        for block in self.blocks.sprites():
-            if block.x_collision_detection(direction, static_tetrominoes):
-                return True
-
-    def shrink_y_hitbox(self) -> None:
-        """ Calls the shrink method of the Y hitbox for each block. """
-        for block in self.blocks.sprites():
-            block.shrink_hitbox()
-
-    def add_blocks_to_group(self, group: pygame.sprite.Group) -> None:
-        for block in self.blocks.sprites():
-            group.add(block)
-
-    def rotate(self) -> None:
-        """ Increases and resets the current_rotation integer accordingly. """
-        if self.current_rotation == len(constants.TETROMINO_SHAPES.get(self.shape)) - 1:
-            self.current_rotation = 0
-        else:
-            self.current_rotation += 1
-
-    def move_left(self) -> None:
-        """ Moves the Tetromino to the left on the grid. """
-        self.rect.x -= 1 * constants.BLOCK_SIZE
-
-    def move_right(self) -> None:
-        """ Moves the Tetromino to the right on the grid. """
-        self.rect.x += 1 * constants.BLOCK_SIZE
-
-    def move_down(self) -> None:
-        """ Moves the Tetromino down the grid. """
-        self.rect.y += constants.BLOCK_SIZE
-
-    def is_outside_game_area(self) -> bool:
-        # todo - something really wrong here...
-        for block in self.blocks.sprites():
-            if block.get_x(True) >= 360:
-                return True
-
-    def confined(self, direction) -> bool:
-        """ Returns true unless a block is heading outside of the game area. """
-        for block in self.blocks.sprites():
-            x, y = block.get_x(), block.get_y()
-            if direction == "down" and y >= 17:
-                return False
-            elif direction == "left" and x <= 0:
-                return False
-            elif direction == "right" and x >= 9:
-                return False
-        return True
+            block.set_colour(self.colour)
 
     def draw(self, surface: pygame.Surface) -> None:
         """ Calculates the where to draw each block, and then calls the blocks own draw() method. """
+        cells = self.piece.get_cells()
+        for block in self.blocks.sprites():
+            x, y = cells[block.get_block_id()]
+            block.draw(surface, [x*constants.BLOCK_SIZE, y*constants.BLOCK_SIZE])
 
-        # i will be iterated, and will draw the correct block according to each block's ID.
-        i = 0
-        x, y = self.get_x(True), self.get_y(True)
-
-        for string in constants.TETROMINO_SHAPES.get(self.shape)[self.current_rotation]:
-            for char in string:
-                if char == '-':
-                    x += constants.BLOCK_SIZE
-                elif char == 'B':
-                    for block in self.blocks.sprites():
-                        if i == block.get_block_id():
-                            block.draw(surface, [x, y])
-                            x += constants.BLOCK_SIZE
-                    i += 1
-            x = self.get_x(True)
-            y += constants.BLOCK_SIZE
-
-    def get_x(self, return_raw_data: bool = False) -> int:
-        """ Returns the X co-ordinate of the Tetromino. """
-        if return_raw_data:
-            return self.rect.x
-        else:
-            return self.rect.x // constants.BLOCK_SIZE
 
-    def get_y(self, return_raw_data: bool = False) -> int:
-        """ Returns the Y co-ordinate of the Tetromino. """
-        if return_raw_data:
-            return self.rect.y
-        else:
-            return self.rect.y // constants.BLOCK_SIZE
+class TetrominoPool:
+    """ Keeps Tetrominoes that are no longer drawn, and their blocks, to be reset and used again.
+        --- Only a few are ever needed at once, so after the first pieces nothing new is allocated.
+        --- hits and misses count the acquires that reused a Tetromino and that had to make one. """
 
-    def set_x(self, x: int, parse_raw_data: bool = False):
-        """ Sets the X co-ordinate of the Tetromino. """
-        if parse_raw_data:
-            self.rect.x = x
+    def __init__(self):
+        self.free: List[Tetromino] = []
+        self.hits: int = 0
+        self.misses: int = 0
+        self.live: int = 0
+        self.peak_live: int = 0
+
+    def acquire(self, piece: Piece) -> Tetromino:
+        """ Returns a Tetromino drawing the piece, reusing a free one if there is one. """
+        if self.free:
+            tetromino = self.free.pop()
+            tetromino.reset(piece)
+            self.hits += 1
         else:
-            self.rect.x = x * constants.BLOCK_SIZE
+            tetromino = Tetromino(piece)
+            self.misses += 1
+        self.live += 1
+        self.peak_live = max(self.peak_live, self.live)
+        return tetromino
 
-    def set_y(self, y: int, parse_raw_data: bool = False):
-        """ Sets the Y co-ordinate of the Tetromino. """
-        if parse_raw_data:
-            self.rect.y = y
-        else:
-            self.rect.y = y * constants.BLOCK_SIZE
+    def release(self, tetromino: Tetromino) -> None:
+        """ Gives back a Tetromino that won't be drawn again until it's acquired. """
+        self.live -= 1
+        self.free.append(tetromino)
+
+    def stats(self) -> Dict[str, int]:
+        return {"pool_hits": self.hits, "pool_misses": self.misses,
+                "pool_live": self.live, "pool_peak_live": self.peak_live}
 
 
 if __name__ == "__main__":
-    play_tetris = SetupGame()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tetris")
+    parser.add_argument("--seed", type=int, help="seed for the random pieces")
+    parser.add_argument("--randomizer", default="uniform", choices=list(RANDOMIZERS),
+                        help="how the shapes of the pieces are chosen")
+    parser.add_argument("--preview", type=int, default=1, choices=range(1, MAX_PREVIEW + 1), metavar="N",
+                        help="number of upcoming pieces to show, from 1 to {}".format(MAX_PREVIEW))
+    parser.add_argument("--record", metavar="FILE", help="save a replay of the game to FILE when it's closed")
+    parser.add_argument("--replay", metavar="FILE", help="watch a replay saved with --record")
+    parser.add_argument("--autoplay", action="store_true", help="let the bot play")
+    parser.add_argument("--move-budget", type=float, metavar="MS",
+                        help="longest the bot may think about each move, in milliseconds; defaults to 8 with "
+                             "--autoplay, and to no limit with --simulate so results depend only on the seed")
+    parser.add_argument("--fast-forward", action="store_true",
+                        help="run the game as fast as possible, press F to switch back to normal speed")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="save frame timings to FILE when the game is closed, as CSV if it ends in .csv")
+    parser.add_argument("--spectate", type=int, metavar="PORT",
+                        help="stream the game to spectators connecting to PORT on localhost")
+    parser.add_argument("--spectate-socket", metavar="PATH", help="stream the game to spectators on a Unix socket")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="print how long each stage of starting the game took, once the first frame is drawn")
+    parser.add_argument("--simulate", type=int, metavar="GAMES",
+                        help="play GAMES games without a window, printing each result as a line of JSON")
+    parser.add_argument("--workers", type=int, help="number of processes to simulate with, defaults to one per core")
+    parser.add_argument("--policy", default="random", choices=["random", "bot", "script"],
+                        help="how simulated games are played")
+    parser.add_argument("--script", metavar="FILE", help="replay whose actions the script policy plays")
+    parser.add_argument("--max-ticks", type=int, default=10**6, help="stop simulated games after this many ticks")
+    args = parser.parse_args()
+
+    if args.simulate is not None:
+        if args.policy == "script" and args.script is None:
+            parser.error("--policy script needs --script")
+        import simulate
+
+        script = None
+        if args.script is not None:
+            with open(args.script, "rb") as script_file:
+                script = script_file.read()
+        simulate.run_campaign(args.simulate, args.seed or 0, args.policy, args.max_ticks, args.workers, script,
+                              randomizer=args.randomizer, budget_ms=args.move_budget)
+        quit()
+
+    replay_to_watch = None
+    if args.replay is not None:
+        with open(args.replay, "rb") as replay_file:
+            replay_to_watch = Replay.load(replay_file)
+
+    bot_player = None
+    if args.autoplay:
+        import bot
+
+        bot_player = bot.BeamSearchBot(budget_ms=args.move_budget if args.move_budget is not None else 8.0,
+                                       lookahead=args.preview)
+
+    spectator_server = None
+    if args.spectate is not None or args.spectate_socket is not None:
+        import spectator
+
+        spectator_server = spectator.SpectatorServer(port=args.spectate or 0, path=args.spectate_socket)
+        spectator_server.start()
+
+    play_tetris = SetupGame(args.seed, args.record, replay_to_watch, bot_player, args.fast_forward, args.profile,
+                            args.preview, args.randomizer, spectator_server)
+    play_tetris.loop()
+    STARTUP.mark("first frame")
+    if args.startup_profile:
+        STARTUP.report()
 
     while True:
         play_tetris.loop()
@@ -0,0 +1,267 @@
+import random
+import numpy as np
+import constants
+import scoring
+import shapes
+from engine import Action
+from pieces import COLOUR_INDEXES, SHAPE_INDEXES, PieceSource
+from typing import Dict, List, Optional, Tuple
+
+# Action 0 does nothing; every other action is an engine.Action.
+NO_ACTION = 0
+# The value of the falling Tetromino's cells in an observation. Static blocks are their colour index + 1.
+FALLING_CELL = len(constants.COLOURS) + 1
+
+
+def compile_offsets() -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ Returns the block offsets of every rotation of every shape, as (shape, rotation, block) arrays of
+        columns and rows, along with the number of rotations of each shape and the lowest row of each rotation.
+        --- Shapes with fewer than four rotations repeat them, so any rotation index can be looked up. """
+    count = len(shapes.SHAPE_NAMES)
+    columns = np.zeros((count, 4, shapes.BLOCKS_PER_SHAPE), dtype=np.intp)
+    rows = np.zeros((count, 4, shapes.BLOCKS_PER_SHAPE), dtype=np.intp)
+    max_y = np.zeros((count, 4), dtype=np.intp)
+    rotation_counts = np.zeros(count, dtype=np.intp)
+    for s, name in enumerate(shapes.SHAPE_NAMES):
+        rotations = shapes.SHAPES[name]
+        rotation_counts[s] = len(rotations)
+        for r in range(4):
+            rotation = rotations[r % len(rotations)]
+            columns[s, r] = [column for column, row in rotation.cells]
+            rows[s, r] = [row for column, row in rotation.cells]
+            max_y[s, r] = rotation.max_y
+    return columns, rows, rotation_counts, max_y
+
+
+CELL_COLUMNS, CELL_ROWS, ROTATION_COUNTS, MAX_Y = compile_offsets()
+
+
+def compile_points(levels: int = 10) -> np.ndarray:
+    """ Returns the points for clearing 0 to 4 lines at each level, taken from Scoring's own tables.
+        --- Levels past the last row score the same as the last row. """
+    score = scoring.Scoring()
+    points = np.zeros((levels, 5), dtype=np.int64)
+    for level in range(levels):
+        score.level = level
+        points[level, 1:] = score.scores[score.get_score_table()]
+    return points
+
+
+POINTS = compile_points()
+# Ticks between gravity steps at each level, the same as Engine.gravity_interval().
+GRAVITY_INTERVALS = np.array([max(1, speed * constants.TICKS_PER_SECOND // 1000) for speed in constants.GRAVITY_SPEEDS],
+                             dtype=np.int64)
+
+
+class VectorEnv:
+    """ Runs num_envs games at once, with every board held in one (num_envs, height, width) array.
+        --- step(actions) gives each game one action and then one tick, the same as Engine.act() followed by
+            Engine.tick(), for all of the games in a handful of NumPy operations.
+        --- Games that end are started again straight away, with a new seed. The seed of each game's current
+            episode is in seeds, and Engine(seed) given the same actions on the same ticks plays the same game.
+        --- Only spawning a Tetromino drops into Python, for the PieceSource of the game it spawns in. """
+
+    def __init__(self, num_envs: int, seed: Optional[int] = None, randomizer: str = "uniform",
+                 width: int = constants.BOARD_WIDTH, height: int = constants.BOARD_HEIGHT):
+        self.num_envs: int = num_envs
+        self.width: int = width
+        self.height: int = height
+        self.randomizer: str = randomizer
+        # Chooses the seed of every episode, so a run of episodes can be repeated.
+        self.rng: random.Random = random.Random(seed)
+
+        self.boards: np.ndarray = np.zeros((num_envs, height, width), dtype=np.uint8)
+        # The falling Tetromino of each game, and the shape of the one after it.
+        self.shape: np.ndarray = np.zeros(num_envs, dtype=np.intp)
+        self.colour: np.ndarray = np.zeros(num_envs, dtype=np.uint8)
+        self.rotation: np.ndarray = np.zeros(num_envs, dtype=np.intp)
+        self.x: np.ndarray = np.zeros(num_envs, dtype=np.intp)
+        self.y: np.ndarray = np.zeros(num_envs, dtype=np.intp)
+        self.next_shape: np.ndarray = np.zeros(num_envs, dtype=np.intp)
+
+        self.gravity_timer: np.ndarray = np.zeros(num_envs, dtype=np.int64)
+        self.soft_drop: np.ndarray = np.zeros(num_envs, dtype=bool)
+        self.score: np.ndarray = np.zeros(num_envs, dtype=np.int64)
+        self.level: np.ndarray = np.ones(num_envs, dtype=np.int64)
+        self.level_lines: np.ndarray = np.zeros(num_envs, dtype=np.int64)
+        self.ticks: np.ndarray = np.zeros(num_envs, dtype=np.int64)
+        self.pieces_placed: np.ndarray = np.zeros(num_envs, dtype=np.int64)
+        self.lines_cleared: np.ndarray = np.zeros(num_envs, dtype=np.int64)
+
+        self.seeds: np.ndarray = np.zeros(num_envs, dtype=np.int64)
+        self.sources: List[Optional[PieceSource]] = [None] * num_envs
+        # Games that ended during the current step, waiting to be started again.
+        self.done: np.ndarray = np.zeros(num_envs, dtype=bool)
+        self.observation: np.ndarray = np.zeros((num_envs, height, width), dtype=np.uint8)
+        self.all_envs: np.ndarray = np.arange(num_envs)
+
+        self.reset()
+
+    def reset(self) -> np.ndarray:
+        """ Starts every game again. Returns the first observation. """
+        self.reset_envs(self.all_envs)
+        return self.observe()
+
+    def reset_envs(self, envs: np.ndarray) -> None:
+        """ Starts the given games again, each with a new seed. """
+        self.boards[envs] = 0
+        for state in (self.gravity_timer, self.score, self.level_lines, self.ticks, self.pieces_placed,
+                      self.lines_cleared):
+            state[envs] = 0
+        self.soft_drop[envs] = False
+        self.level[envs] = 1
+        for i in envs.tolist():
+            self.seeds[i] = self.rng.getrandbits(32)
+            self.sources[i] = PieceSource(int(self.seeds[i]), self.randomizer)
+        self.spawn(envs)
+
+    def spawn(self, envs: np.ndarray) -> None:
+        """ Moves the next Piece of each of the given games into play, like Engine.spawn(). """
+        for i in envs.tolist():
+            source = self.sources[i]
+            piece = source.next_piece()
+            self.shape[i] = SHAPE_INDEXES[piece.shape]
+            self.colour[i] = COLOUR_INDEXES[piece.colour] + 1
+            self.x[i] = piece.spawn_x
+            self.next_shape[i] = SHAPE_INDEXES[source.peek().shape]
+        self.rotation[envs] = 0
+        self.y[envs] = -MAX_Y[self.shape[envs], 0]
+        self.gravity_timer[envs] = 0
+
+    def cells(self, envs: np.ndarray, rotation: np.ndarray, dx: int = 0, dy: int = 0
+              ) -> Tuple[np.ndarray, np.ndarray]:
+        """ Returns the columns and rows of the blocks of the given games' Tetrominoes, as (len(envs), 4) arrays. """
+        shape = self.shape[envs]
+        columns = self.x[envs, None] + dx + CELL_COLUMNS[shape, rotation]
+        rows = self.y[envs, None] + dy + CELL_ROWS[shape, rotation]
+        return columns, rows
+
+    def occupied(self, envs: np.ndarray, columns: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """ Returns true for each cell inside the game area that holds a static block, like Board.is_occupied(). """
+        inside = (columns >= 0) & (columns < self.width) & (rows >= 0) & (rows < self.height)
+        cells = self.boards[envs[:, None], np.clip(rows, 0, self.height - 1), np.clip(columns, 0, self.width - 1)]
+        return inside & (cells != 0)
+
+    def fits(self, envs: np.ndarray, columns: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """ Returns true for each game where every one of the cells is free, like Board.fits(). """
+        in_bounds = (columns >= 0) & (columns < self.width) & (rows < self.height)
+        return (in_bounds & ~self.occupied(envs, columns, rows)).all(axis=1)
+
+    def act(self, actions: np.ndarray) -> None:
+        """ Applies one action to each game, like Engine.act(). """
+        for action, dx in ((Action.LEFT, -1), (Action.RIGHT, 1)):
+            envs = np.flatnonzero(actions == action)
+            if len(envs):
+                columns, rows = self.cells(envs, self.rotation[envs], dx=dx)
+                envs = envs[self.fits(envs, columns, rows)]
+                self.x[envs] += dx
+        envs = np.flatnonzero(actions == Action.ROTATE)
+        if len(envs):
+            rotation = (self.rotation[envs] + 1) % ROTATION_COUNTS[self.shape[envs]]
+            columns, rows = self.cells(envs, rotation)
+            turned = self.fits(envs, columns, rows)
+            self.rotation[envs[turned]] = rotation[turned]
+        self.soft_drop |= actions == Action.SOFT_DROP
+        self.level += actions == Action.LEVEL_UP
+        envs = np.flatnonzero(actions == Action.HARD_DROP)
+        if len(envs):
+            self.y[envs] += self.drop_distances(envs)
+            self.lock(envs)
+
+    def drop_distances(self, envs: np.ndarray) -> np.ndarray:
+        """ Returns how many rows each of the given games' Tetrominoes can fall, like Board.drop_distance(). """
+        columns, rows = self.cells(envs, self.rotation[envs])
+        # (game, block, row), true for each static block below a block of the Tetromino.
+        below = (self.boards[envs[:, None], :, columns] != 0) & (np.arange(self.height) > rows[:, :, None])
+        first = np.where(below.any(axis=2), below.argmax(axis=2), self.height)
+        return (first - 1 - rows).min(axis=1)
+
+    def step(self, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+        """ Gives every game one action, then advances it by one tick.
+            --- actions holds an engine.Action, or NO_ACTION, for each game.
+            --- Returns the observation, the points each game scored, which games ended, and info holding
+                the final score, lines cleared and pieces placed of the games that ended. Games that ended
+                have already been started again, so their observation is of the new game. """
+        actions = np.asarray(actions)
+        if actions.shape != (self.num_envs,):
+            raise ValueError("Expected {} actions, got an array of shape {}".format(self.num_envs, actions.shape))
+        if ((actions < NO_ACTION) | (actions > max(Action))).any():
+            raise ValueError("Unknown action in {}".format(actions))
+        score = self.score.copy()
+        self.done[:] = False
+
+        self.act(actions)
+        self.ticks += 1
+
+        # A Tetromino resting on a static block stops, like Piece.y_collision(). The floor is left to gravity.
+        playing = ~self.done
+        columns, rows = self.cells(self.all_envs, self.rotation, dy=1)
+        self.lock(np.flatnonzero(self.occupied(self.all_envs, columns, rows).any(axis=1) & playing))
+
+        playing = ~self.done
+        self.gravity_timer += np.where(self.soft_drop, constants.SOFT_DROP_MULTIPLIER, 1) * playing
+        level = np.minimum(self.level, len(GRAVITY_INTERVALS) - 1)
+        falling = (self.gravity_timer >= GRAVITY_INTERVALS[level]) & playing
+        if falling.any():
+            bottom = self.y + MAX_Y[self.shape, self.rotation]
+            confined = bottom < self.height - 1
+            self.y += falling & confined
+            self.lock(np.flatnonzero(falling & ~confined))
+            self.gravity_timer[falling] = 0
+
+        rewards = self.score - score
+        done = self.done.copy()
+        info = {"score": np.where(done, self.score, 0),
+                "lines_cleared": np.where(done, self.lines_cleared, 0),
+                "pieces_placed": np.where(done, self.pieces_placed, 0)}
+        if done.any():
+            self.reset_envs(np.flatnonzero(done))
+        return self.observe(), rewards, done, info
+
+    def lock(self, envs: np.ndarray) -> None:
+        """ Places the given games' Tetrominoes, clears complete rows, scores them and checks for game over,
+            like Engine.stop_current_piece(). Games that carry on get their next Tetromino. """
+        if not len(envs):
+            return
+        columns, rows = self.cells(envs, self.rotation[envs])
+        above = rows < 0
+        owners = np.broadcast_to(envs[:, None], rows.shape)
+        below = ~above
+        self.boards[owners[below], rows[below], columns[below]] = self.colour[owners[below]]
+        self.pieces_placed[envs] += 1
+        self.soft_drop[envs] = False
+
+        full = (self.boards[envs] != 0).all(axis=2)
+        lines = full.sum(axis=1)
+        cleared = lines > 0
+        if cleared.any():
+            self.clear_rows(envs[cleared], full[cleared], lines[cleared])
+            self.lines_cleared[envs] += lines
+            self.level_lines[envs] += lines
+            level_up = self.level_lines[envs] >= 10
+            self.level[envs[level_up]] += 1
+            self.level_lines[envs[level_up]] = 0
+            self.score[envs] += POINTS[np.minimum(self.level[envs], len(POINTS) - 1), np.minimum(lines, 4)]
+
+        # The game ends when a Tetromino stops partly above the game area, or blocks reach the top two rows.
+        over = above.any(axis=1) | (self.boards[envs, :2] != 0).any(axis=(1, 2))
+        self.done[envs[over]] = True
+        self.spawn(envs[~over])
+
+    def clear_rows(self, envs: np.ndarray, full: np.ndarray, lines: np.ndarray) -> None:
+        """ Moves the complete rows to the top of each board, keeping the order of the rest, then empties them. """
+        order = np.argsort(~full, axis=1, kind="stable")
+        boards = np.take_along_axis(self.boards[envs], order[:, :, None], axis=1)
+        boards[np.arange(self.height)[None, :] < lines[:, None]] = 0
+        self.boards[envs] = boards
+
+    def observe(self) -> np.ndarray:
+        """ Returns every board with its falling Tetromino drawn in as FALLING_CELL.
+            --- The array is reused by every call, so copy it to keep it past the next step. """
+        observation = self.observation
+        observation[:] = self.boards
+        columns, rows = self.cells(self.all_envs, self.rotation)
+        visible = rows >= 0
+        owners = np.broadcast_to(self.all_envs[:, None], rows.shape)
+        observation[owners[visible], rows[visible], columns[visible]] = FALLING_CELL
+        return observation
@@ -0,0 +1,156 @@
+import random
+import shapes
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+# Keys come from a fixed seed, so hashes are the same in every process and every run.
+ZOBRIST_SEED = 0x7E7815
+# Rough size of an entry's bookkeeping in a TranspositionTable, on top of the size of its value.
+ENTRY_BYTES = 200
+
+
+@lru_cache(maxsize=None)
+def cell_keys(width: int, height: int) -> Tuple[int, ...]:
+    """ Returns a random 64 bit key for each cell of a board, in cell order.
+        --- A board's hash is the XOR of the keys of its occupied cells. """
+    rng = random.Random(ZOBRIST_SEED * 1000003 + width * 1009 + height)
+    return tuple(rng.getrandbits(64) for _ in range(width * height))
+
+
+@lru_cache(maxsize=None)
+def full_row_keys(width: int, height: int) -> Tuple[int, ...]:
+    """ Returns the XOR of the keys of every cell in each row. """
+    keys = cell_keys(width, height)
+    rows = []
+    for y in range(height):
+        row = 0
+        for key in keys[y * width:(y + 1) * width]:
+            row ^= key
+        rows.append(row)
+    return tuple(rows)
+
+
+# Columns covered by each table from row_tables().
+ROW_TABLE_BITS = 5
+
+
+@lru_cache(maxsize=None)
+def row_tables(width: int, height: int) -> Tuple[Tuple[Tuple[int, ...], ...], ...]:
+    """ Returns tables for hashing a whole row at once, from a mask with a bit set for each occupied column.
+        --- For each row there's a table for every ROW_TABLE_BITS columns, holding the XOR of the keys of
+            the columns in each of their combinations. """
+    keys = cell_keys(width, height)
+    tables = []
+    for y in range(height):
+        row_tables = []
+        for first in range(0, width, ROW_TABLE_BITS):
+            columns = range(first, min(first + ROW_TABLE_BITS, width))
+            table = [0] * (1 << len(columns))
+            for mask in range(1, len(table)):
+                low = (mask & -mask).bit_length() - 1
+                table[mask] = table[mask & (mask - 1)] ^ keys[y * width + columns[low]]
+            row_tables.append(tuple(table))
+        tables.append(tuple(row_tables))
+    return tuple(tables)
+
+
+def row_hash(tables: Tuple[Tuple[int, ...], ...], mask: int) -> int:
+    """ Returns the XOR of the keys of the occupied columns of a row, given the row's tables. """
+    result = 0
+    for table in tables:
+        result ^= table[mask & ((1 << ROW_TABLE_BITS) - 1)]
+        mask >>= ROW_TABLE_BITS
+    return result
+
+
+@lru_cache(maxsize=None)
+def piece_key(shape: str, rotation: int = 0, x: int = 0, y: int = 0) -> int:
+    """ Returns the key for a piece of the given shape, rotation and position. """
+    rng = random.Random(ZOBRIST_SEED * 1000003 + 7919 * (shapes.SHAPE_NAMES.index(shape) + 1)
+                        + 104729 * rotation + 1299709 * (x + 64) + 15485863 * (y + 64))
+    return rng.getrandbits(64)
+
+
+@lru_cache(maxsize=None)
+def shape_key(shape: str) -> int:
+    """ Returns the key for a piece of the given shape that is still to be placed, with no position. """
+    rng = random.Random(ZOBRIST_SEED * 1000003 + 7919 * (shapes.SHAPE_NAMES.index(shape) + 1) - 1)
+    return rng.getrandbits(64)
+
+
+class TranspositionTable:
+    """ Remembers values by hash, up to a rough limit of max_bytes.
+        --- put() is given the size of each value, and ENTRY_BYTES is added to it for the table's own
+            bookkeeping. When the limit is passed, entries are evicted by policy:
+        --- "lru" evicts the least recently used entry.
+        --- "depth" evicts from the entries with the lowest depth first, least recently used among those,
+            so the values that took the most work to find are kept longest. """
+
+    def __init__(self, max_bytes: int = 64 * 2**20, policy: str = "lru"):
+        if policy not in ("lru", "depth"):
+            raise ValueError("Unknown eviction policy {!r}".format(policy))
+        self.max_bytes: int = max_bytes
+        self.policy: str = policy
+        # Each entry is (value, depth, size). With the depth policy there's a table for each depth.
+        self.tables: Dict[int, "OrderedDict[Any, Tuple[Any, int, int]]"] = {}
+        self.depths: Dict[Any, int] = {}
+        self.bytes: int = 0
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def __len__(self) -> int:
+        return len(self.depths)
+
+    def get(self, key: Any) -> Optional[Any]:
+        """ Returns the value for key, or None if there isn't one. """
+        depth = self.depths.get(key)
+        if depth is None:
+            self.misses += 1
+            return None
+        table = self.tables[depth]
+        table.move_to_end(key)
+        self.hits += 1
+        return table[key][0]
+
+    def put(self, key: Any, value: Any, size: int, depth: int = 0) -> None:
+        """ Stores value, which takes about size bytes, evicting other entries if the table is full. """
+        if self.policy == "lru":
+            depth = 0
+        if key in self.depths:
+            self.remove(key)
+        size += ENTRY_BYTES
+        if size > self.max_bytes:
+            return
+        while self.bytes + size > self.max_bytes:
+            self.evict()
+        table = self.tables.get(depth)
+        if table is None:
+            table = self.tables[depth] = OrderedDict()
+        table[key] = (value, depth, size)
+        self.depths[key] = depth
+        self.bytes += size
+
+    def remove(self, key: Any) -> None:
+        depth = self.depths.pop(key)
+        self.bytes -= self.tables[depth].pop(key)[2]
+
+    def evict(self) -> None:
+        """ Removes one entry, from the lowest depth that has any. """
+        depth = min(depth for depth, table in self.tables.items() if table)
+        key, (value, depth, size) = self.tables[depth].popitem(last=False)
+        del self.depths[key]
+        self.bytes -= size
+        self.evictions += 1
+
+    def clear(self) -> None:
+        self.tables.clear()
+        self.depths.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self),
+                "bytes": self.bytes, "hit_rate": self.hits / lookups if lookups else 0.0}